@@ -0,0 +1,63 @@
+"""
+Database tuning shared by all apps.
+
+configure_sqlite applies settings.SQLITE_PRAGMAS to every new SQLite connection
+(connected to connection_created in DataEntryConfig.ready). retry_on_lock
+retries a write when SQLite reports the database as locked, which WAL and
+busy_timeout make rare but cannot rule out for transactions that read before
+they write.
+"""
+import functools
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+logger = logging.getLogger(__name__)
+
+LOCK_RETRY_ATTEMPTS = 5
+LOCK_RETRY_BASE_DELAY = 0.2  # seconds, doubled after every failed attempt
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created receiver: apply the SQLite pragmas from settings"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def is_lock_error(exc):
+    """True for SQLite's 'database is locked' / 'database table is locked' errors"""
+    return isinstance(exc, OperationalError) and 'is locked' in str(exc)
+
+
+def retry_on_lock(func=None, *, attempts=LOCK_RETRY_ATTEMPTS, base_delay=LOCK_RETRY_BASE_DELAY):
+    """
+    Retry func with exponential backoff while the database is locked.
+
+    Use as a decorator (with or without arguments) around a function that does
+    its own writes in autocommit or in its own transaction.atomic() block. Inside
+    an outer transaction a retry cannot help (the outer block has to be redone),
+    so the error is raised right away there.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(attempts):
+                try:
+                    return func(*args, **kwargs)
+                except OperationalError as exc:
+                    if not is_lock_error(exc) or connection.in_atomic_block or attempt == attempts - 1:
+                        raise
+                    delay = base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+                    logger.warning('%s: database locked, retrying in %.2fs', func.__qualname__, delay)
+                    time.sleep(delay)
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
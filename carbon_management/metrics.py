@@ -0,0 +1,257 @@
+"""
+Prometheus-style metrics shared by all gunicorn workers.
+
+Counters and histograms are kept in a small SQLite file (settings.METRICS_DB,
+separate from the application database) so every worker process adds to the
+same totals and any of them can answer a scrape. Requests only add to an
+in-memory aggregate; one background thread per process writes it to the file
+every FLUSH_INTERVAL seconds, so recording never waits on the disk or on another
+worker's lock. Gauges such as the ImportTask queue depth are read from the
+database at scrape time.
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+
+# Upper bounds (seconds / bytes) of the histogram buckets; +Inf is implicit
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+IMPORT_DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800)
+EXPORT_SIZE_BUCKETS = (1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+BUCKETS = {
+    'http_request_duration_seconds': LATENCY_BUCKETS,
+    'import_duration_seconds': IMPORT_DURATION_BUCKETS,
+    'export_size_bytes': EXPORT_SIZE_BUCKETS,
+    'export_duration_seconds': LATENCY_BUCKETS,
+}
+
+HELP = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by URL name'),
+    'import_rows_total': ('counter', 'Rows read by finished imports'),
+    'import_success_rows_total': ('counter', 'Rows written by finished imports'),
+    'import_error_rows_total': ('counter', 'Rows rejected by finished imports'),
+    'import_duration_seconds': ('histogram', 'Wall time of finished imports'),
+    'import_last_rows_per_second': ('gauge', 'Throughput of the most recent import'),
+    'export_size_bytes': ('histogram', 'Size of file downloads by URL name'),
+    'export_duration_seconds': ('histogram', 'Time to build file downloads by URL name'),
+    'import_tasks': ('gauge', 'ImportTask rows by kind and status'),
+}
+
+# Seconds between flushes of the in-memory aggregate to METRICS_DB
+FLUSH_INTERVAL = 5
+# A flush that cannot get the write lock this quickly is retried at the next interval
+FLUSH_LOCK_TIMEOUT = 0.05
+
+_local = threading.local()
+_lock = threading.Lock()
+# (name, labels json, le) -> value to add / value to set at the next flush
+_pending = {}
+_pending_gauges = {}
+_flusher_pid = None
+
+
+def _connect():
+    db = getattr(_local, 'db', None)
+    if db is None:
+        db = sqlite3.connect(str(settings.METRICS_DB), timeout=FLUSH_LOCK_TIMEOUT, isolation_level=None)
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS metric ('
+            ' name TEXT NOT NULL, labels TEXT NOT NULL, le TEXT NOT NULL, value REAL NOT NULL,'
+            ' PRIMARY KEY (name, labels, le))'
+        )
+        _local.db = db
+    return db
+
+
+def _histogram_rows(name, labels, value):
+    # One row for the bucket the value falls into (not cumulative), plus _sum and _count
+    buckets = BUCKETS[name]
+    position = bisect_left(buckets, value)
+    le = _format_value(buckets[position]) if position < len(buckets) else '+Inf'
+    return [
+        (name + '_bucket', labels, le, 1),
+        (name + '_sum', labels, '', value),
+        (name + '_count', labels, '', 1),
+    ]
+
+
+def _write(rows, replace=False):
+    """Add (name, labels dict, le, value) rows to this process's aggregate
+
+    With replace, the rows set their value instead of adding to it.
+    """
+    if not getattr(settings, 'METRICS_ENABLED', True) or not rows:
+        return
+    with _lock:
+        for name, labels, le, value in rows:
+            key = (name, json.dumps(labels, sort_keys=True), le)
+            if replace:
+                _pending_gauges[key] = value
+            else:
+                _pending[key] = _pending.get(key, 0) + value
+    _start_flusher()
+
+
+def _start_flusher():
+    global _flusher_pid
+    # Threads do not survive fork, so each gunicorn worker starts its own
+    pid = os.getpid()
+    if _flusher_pid == pid:
+        return
+    with _lock:
+        if _flusher_pid == pid:
+            return
+        _flusher_pid = pid
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def flush():
+    """Write this process's aggregate to METRICS_DB in one transaction
+
+    If another worker holds the write lock the values are kept for the next
+    flush instead of waiting for it.
+    """
+    with _lock:
+        pending, gauges = dict(_pending), dict(_pending_gauges)
+        _pending.clear()
+        _pending_gauges.clear()
+    if not pending and not gauges:
+        return
+    try:
+        db = _connect()
+        with db:
+            db.execute('BEGIN')
+            db.executemany(
+                'INSERT INTO metric (name, labels, le, value) VALUES (?, ?, ?, ?)'
+                ' ON CONFLICT (name, labels, le) DO UPDATE SET value = value + excluded.value',
+                [key + (value,) for key, value in pending.items()]
+            )
+            db.executemany(
+                'INSERT OR REPLACE INTO metric (name, labels, le, value) VALUES (?, ?, ?, ?)',
+                [key + (value,) for key, value in gauges.items()]
+            )
+    except sqlite3.Error:
+        # Metrics must never slow down the requests and imports that report them
+        with _lock:
+            for key, value in pending.items():
+                _pending[key] = _pending.get(key, 0) + value
+            for key, value in gauges.items():
+                _pending_gauges.setdefault(key, value)
+
+
+atexit.register(flush)
+
+
+def record_request(url_name, method, duration, export_bytes=None):
+    """Record one request's latency and, for file downloads, the export size and duration"""
+    labels = {'url_name': url_name, 'method': method}
+    rows = _histogram_rows('http_request_duration_seconds', labels, duration)
+    if export_bytes is not None:
+        labels = {'url_name': url_name}
+        rows += _histogram_rows('export_size_bytes', labels, export_bytes)
+        rows += _histogram_rows('export_duration_seconds', labels, duration)
+    _write(rows)
+
+
+def record_import(kind, total_rows, success_rows, error_rows, duration):
+    """Record a finished ImportTask run"""
+    labels = {'kind': kind}
+    rows = [
+        ('import_rows_total', labels, '', total_rows),
+        ('import_success_rows_total', labels, '', success_rows),
+        ('import_error_rows_total', labels, '', error_rows),
+    ]
+    rows += _histogram_rows('import_duration_seconds', labels, duration)
+    _write(rows)
+    if duration > 0:
+        _write([('import_last_rows_per_second', labels, '', total_rows / duration)], replace=True)
+
+
+def _format_labels(labels, le=''):
+    items = sorted(labels.items())
+    if le:
+        items.append(('le', le))
+    if not items:
+        return ''
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in items
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format"""
+    from data_entry.models import ImportTask
+    from django.db.models import Count
+
+    # Other workers' values are at most FLUSH_INTERVAL seconds behind
+    flush()
+    series = {}
+    try:
+        for name, labels, le, value in _connect().execute('SELECT name, labels, le, value FROM metric'):
+            series.setdefault(name, {}).setdefault(labels, {})[le] = value
+    except sqlite3.Error:
+        pass
+
+    lines = []
+    for metric, (kind, help_text) in HELP.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        if metric == 'import_tasks':
+            for item in ImportTask.objects.order_by().values('kind', 'status').annotate(count=Count('id')):
+                labels = {'kind': item['kind'], 'status': item['status']}
+                lines.append(f'import_tasks{_format_labels(labels)} {item["count"]}')
+            continue
+        if kind == 'histogram':
+            for labels_json, counts in sorted(series.get(metric + '_bucket', {}).items()):
+                labels = json.loads(labels_json)
+                cumulative = 0
+                for le in [_format_value(bound) for bound in BUCKETS[metric]] + ['+Inf']:
+                    cumulative += counts.get(le, 0)
+                    lines.append(f'{metric}_bucket{_format_labels(labels, le)} {_format_value(cumulative)}')
+                for suffix in ('_sum', '_count'):
+                    value = series.get(metric + suffix, {}).get(labels_json, {}).get('', 0)
+                    lines.append(f'{metric}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        else:
+            for labels_json, values in sorted(series.get(metric, {}).items()):
+                lines.append(f'{metric}{_format_labels(json.loads(labels_json))} {_format_value(values[""])}')
+    return '\n'.join(lines) + '\n'
+
+
+@require_GET
+def metrics_view(request):
+    """
+    /metrics for Prometheus.
+
+    With METRICS_TOKEN set, scrapers authenticate with "Authorization: Bearer
+    <token>"; staff users can always look at it from the browser.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorization = request.headers.get('Authorization', '')
+    authorized = bool(token) and constant_time_compare(authorization, f'Bearer {token}')
+    if not authorized and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
@@ -0,0 +1,158 @@
+"""
+Project-wide middleware.
+"""
+import contextvars
+import logging
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import connection
+from django.template import base as template_base
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SESSION_REFRESHED_KEY = '_session_refreshed_at'
+
+# Timings of the request being handled in this thread / task, or None
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class SessionRefreshMiddleware:
+    """
+    Sliding session expiry without a session write on every request.
+
+    Replaces SESSION_SAVE_EVERY_REQUEST: the session is saved (pushing its expiry
+    SESSION_COOKIE_AGE into the future) only when the last refresh is older than
+    SESSION_REFRESH_THRESHOLD seconds, so frequent requests such as the import
+    progress polls do not write. A session therefore expires between
+    SESSION_COOKIE_AGE - SESSION_REFRESH_THRESHOLD and SESSION_COOKIE_AGE after
+    the last request. Must come after SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'SESSION_REFRESH_THRESHOLD', 300)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        session = getattr(request, 'session', None)
+        if session is None or session.is_empty():
+            return response
+        now = int(time.time())
+        # A session saved anyway (login, messages, ...) counts as a refresh
+        if session.modified or now - session.get(SESSION_REFRESHED_KEY, 0) >= self.threshold:
+            session[SESSION_REFRESHED_KEY] = now
+        return response
+
+
+class RequestTimings:
+    """Counters collected for one request by PerformanceMiddleware"""
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.sql_time += time.perf_counter() - start
+
+
+def _timed_template_render(render):
+    def wrapper(self, context):
+        timings = _request_timings.get()
+        if timings is None:
+            return render(self, context)
+        # Included templates render inside their parent; only time the outermost
+        timings.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            timings.template_depth -= 1
+            if timings.template_depth == 0:
+                timings.template_time += time.perf_counter() - start
+    wrapper.timed = True
+    return wrapper
+
+
+class PerformanceMiddleware:
+    """
+    Per-request timings as a Server-Timing header, plus a log line for slow requests.
+
+    Reports total time, SQL query count and time (connection.execute_wrapper),
+    template render time and, when PERFORMANCE_TRACE_ALLOCATIONS is on, the peak
+    traced Python allocation. tracemalloc slows every allocation down and its peak
+    is process-wide, so keep it for debugging with a single worker thread.
+    Requests slower than PERFORMANCE_SLOW_REQUEST_MS are logged with their view.
+    Latency (and size, for file downloads) also goes to the /metrics store.
+    Should be the first middleware so the total covers the whole stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = getattr(settings, 'PERFORMANCE_SERVER_TIMING', True)
+        self.slow_request_ms = getattr(settings, 'PERFORMANCE_SLOW_REQUEST_MS', 1000)
+        self.trace_allocations = getattr(settings, 'PERFORMANCE_TRACE_ALLOCATIONS', False)
+        if not getattr(template_base.Template.render, 'timed', False):
+            template_base.Template.render = _timed_template_render(template_base.Template.render)
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timings):
+                response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        total_ms = (time.perf_counter() - start) * 1000
+        peak = tracemalloc.get_traced_memory()[1] if self.trace_allocations else None
+
+        server_timing = [
+            f'total;dur={total_ms:.1f}',
+            f'db;dur={timings.sql_time * 1000:.1f};desc="{timings.sql_count} queries"',
+            f'tpl;dur={timings.template_time * 1000:.1f}',
+        ]
+        if peak is not None:
+            server_timing.append(f'mem;desc="peak {peak / 1048576:.1f} MB"')
+        if self.server_timing:
+            response['Server-Timing'] = ', '.join(server_timing)
+
+        match = getattr(request, 'resolver_match', None)
+        export_bytes = None
+        if not response.streaming and response.get('Content-Disposition', '').startswith('attachment'):
+            export_bytes = len(response.content)
+        metrics.record_request(
+            match.view_name if match else 'unmatched', request.method, total_ms / 1000, export_bytes
+        )
+
+        if total_ms >= self.slow_request_ms:
+            logger.warning(
+                'Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, templates %.0f ms%s',
+                request.method, request.path, _view_name(request), total_ms,
+                timings.sql_count, timings.sql_time * 1000, timings.template_time * 1000,
+                f', peak {peak / 1048576:.1f} MB' if peak is not None else '',
+            )
+        return response
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '-'
+    return getattr(match.func, '__name__', None) or match.view_name
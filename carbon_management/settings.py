@@ -44,8 +44,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'carbon_management.middleware.PerformanceMiddleware',  # Server-Timing and slow request log
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'carbon_management.middleware.SessionRefreshMiddleware',  # Sliding expiry, see SESSION_REFRESH_THRESHOLD
     'django.middleware.locale.LocaleMiddleware',  # For internationalization
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -79,11 +81,49 @@ WSGI_APPLICATION = 'carbon_management.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite by default; set DB_ENGINE=django.db.backends.postgresql and the DB_*
+# variables below to use PostgreSQL (see .env.example)
+DB_ENGINE = os.environ.get('DB_ENGINE', 'django.db.backends.sqlite3')
+
+if DB_ENGINE == 'django.db.backends.sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Seconds a connection waits for a lock before "database is locked"
+                'timeout': 30,
+            },
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.environ.get('DB_NAME', 'carbon_management'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Keep connections open between requests (seconds, 0 closes after each
+            # request) and check them before reuse so a restarted server is noticed
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 10)),
+            },
+        }
+    }
+
+# Applied to every new SQLite connection (carbon_management.db.configure_sqlite).
+# WAL lets dashboard reads run while an import writes; NORMAL sync is safe with WAL.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 30000,  # ms
+    'mmap_size': 268435456,  # 256 MB
+    'cache_size': -65536,  # 64 MB (negative values are KiB)
+    'temp_store': 'MEMORY',
 }
 
 
@@ -149,14 +189,47 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Default is 1000, which causes 400/404 when selecting >1000 records.
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000000
 
+# Material import: files with at least IMPORT_PARALLEL_MIN_ROWS rows are validated
+# by IMPORT_PARALLEL_WORKERS processes (set to 1 to always validate in-process)
+IMPORT_PARALLEL_WORKERS = int(os.environ.get('IMPORT_PARALLEL_WORKERS', min(os.cpu_count() or 1, 8)))
+IMPORT_PARALLEL_MIN_ROWS = int(os.environ.get('IMPORT_PARALLEL_MIN_ROWS', 50000))
+
+# Import progress page: push updates over Server-Sent Events instead of polling.
+# Every open stream occupies a worker thread, so only enable this with an async
+# gunicorn worker class (GUNICORN_WORKER_CLASS=gevent); gthread keeps polling.
+IMPORT_PROGRESS_STREAM = os.environ.get('IMPORT_PROGRESS_STREAM', 'False') == 'True'
+
+# Unfinished background tasks without progress for this long are treated as dead
+# (their thread went away with a restarted worker) and no longer block new ones
+IMPORT_TASK_STALE_SECONDS = int(os.environ.get('IMPORT_TASK_STALE_SECONDS', 600))
+
+# Request instrumentation (carbon_management.middleware.PerformanceMiddleware)
+PERFORMANCE_SERVER_TIMING = os.environ.get('PERFORMANCE_SERVER_TIMING', 'True') == 'True'
+PERFORMANCE_SLOW_REQUEST_MS = int(os.environ.get('PERFORMANCE_SLOW_REQUEST_MS', 1000))
+# tracemalloc peak per request; slows every allocation, for debugging only
+PERFORMANCE_TRACE_ALLOCATIONS = os.environ.get('PERFORMANCE_TRACE_ALLOCATIONS', 'False') == 'True'
+
+# /metrics (carbon_management.metrics): counters shared by all workers in a local
+# SQLite file; scrapers send "Authorization: Bearer <METRICS_TOKEN>", staff can browse
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+METRICS_DB = os.environ.get('METRICS_DB', BASE_DIR / 'metrics.sqlite3')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 # Login settings
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
 
 # Session settings
+# Signed cookies keep sessions out of the database, so page views and progress
+# polls never write; set SESSION_ENGINE to e.g. django.contrib.sessions.backends.db
+# to keep sessions server-side (needed to revoke a session before it expires)
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.signed_cookies')
 SESSION_COOKIE_AGE = 86400  # 24 hours
-SESSION_SAVE_EVERY_REQUEST = True
+# Expiry slides with activity: SessionRefreshMiddleware re-saves the session at most
+# once per SESSION_REFRESH_THRESHOLD seconds instead of SESSION_SAVE_EVERY_REQUEST
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_REFRESH_THRESHOLD = int(os.environ.get('SESSION_REFRESH_THRESHOLD', 300))
 
 # Custom user model
 AUTH_USER_MODEL = 'coefficients.CustomUser'
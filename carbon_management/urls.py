@@ -19,10 +19,12 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.conf.urls.i18n import i18n_patterns
+from carbon_management.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('i18n/', include('django.conf.urls.i18n')),
+    path('metrics', metrics_view, name='metrics'),
     path('dashboard/', include('dashboard.urls')),
     path('data-entry/', include('data_entry.urls')),
     path('', include('coefficients.urls')),
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
-from .models import Hotel, CustomUser, EmissionCategory, EmissionCoefficient
+from .models import Hotel, CustomUser, EmissionCategory, EmissionCoefficient, CoefficientVersion, UnitConversion
 
 
 @admin.register(Hotel)
@@ -29,6 +29,13 @@ class EmissionCategoryAdmin(admin.ModelAdmin):
     search_fields = ['name', 'name_en']
 
 
+class CoefficientVersionInline(admin.TabularInline):
+    model = CoefficientVersion
+    extra = 0
+    fields = ['value', 'valid_from', 'valid_to', 'created_at']
+    readonly_fields = ['created_at']
+
+
 @admin.register(EmissionCoefficient)
 class EmissionCoefficientAdmin(admin.ModelAdmin):
     list_display = ['category_level1', 'category_level2', 
@@ -36,3 +43,11 @@ class EmissionCoefficientAdmin(admin.ModelAdmin):
     list_filter = ['category_level1', 'category_level2', 'unit', 'updated_at']
     search_fields = ['special_note']
     readonly_fields = ['created_at', 'updated_at']
+    inlines = [CoefficientVersionInline]
+
+
+@admin.register(UnitConversion)
+class UnitConversionAdmin(admin.ModelAdmin):
+    list_display = ['product_code', 'from_unit', 'to_unit', 'factor', 'updated_at']
+    list_filter = ['to_unit']
+    search_fields = ['product_code', 'from_unit']
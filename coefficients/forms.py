@@ -65,6 +65,16 @@ class EmissionCoefficientForm(forms.ModelForm):
         })
     )
     
+    valid_from = forms.DateField(
+        label=_('生效日期'),
+        required=False,
+        widget=forms.DateInput(attrs={
+            'class': 'form-control',
+            'type': 'date'
+        }),
+        help_text=_('该系数值从此日期起生效；新增时留空表示适用于所有日期，修改时留空表示从今天起生效')
+    )
+    
     class Meta:
         model = EmissionCoefficient
         fields = ['unit', 'coefficient', 'special_note']
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("coefficients", "0013_remove_product_name_from_emissioncoefficient"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CoefficientVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "value",
+                    models.DecimalField(
+                        decimal_places=6, max_digits=10, verbose_name="系数值"
+                    ),
+                ),
+                (
+                    "valid_from",
+                    models.DateField(blank=True, null=True, verbose_name="生效日期"),
+                ),
+                (
+                    "valid_to",
+                    models.DateField(blank=True, null=True, verbose_name="失效日期"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="创建时间"),
+                ),
+                (
+                    "coefficient",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="versions",
+                        to="coefficients.emissioncoefficient",
+                        verbose_name="碳排放系数",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "系数版本",
+                "verbose_name_plural": "系数版本",
+                "ordering": ["coefficient", "valid_from"],
+                "indexes": [
+                    models.Index(
+                        fields=["coefficient", "valid_from"],
+                        name="coefficient_coeffic_d09f9d_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:16
+
+from django.db import migrations
+
+
+def seed_versions(apps, schema_editor):
+    """Give every existing coefficient one open-ended version holding its current value"""
+    EmissionCoefficient = apps.get_model("coefficients", "EmissionCoefficient")
+    CoefficientVersion = apps.get_model("coefficients", "CoefficientVersion")
+    versions = [
+        CoefficientVersion(coefficient_id=pk, value=value)
+        for pk, value in EmissionCoefficient.objects.values_list("pk", "coefficient")
+    ]
+    CoefficientVersion.objects.bulk_create(versions, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("coefficients", "0014_coefficientversion"),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_versions, migrations.RunPython.noop),
+    ]
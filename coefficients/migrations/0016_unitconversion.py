@@ -0,0 +1,79 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:18
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+DEFAULT_CONVERSIONS = [
+    ("g", "KG", Decimal("0.001")),
+    ("克", "KG", Decimal("0.001")),
+    ("mg", "KG", Decimal("0.000001")),
+    ("斤", "KG", Decimal("0.5")),
+    ("公斤", "KG", Decimal("1")),
+    ("t", "KG", Decimal("1000")),
+    ("吨", "KG", Decimal("1000")),
+    ("mL", "L", Decimal("0.001")),
+    ("毫升", "L", Decimal("0.001")),
+    ("升", "L", Decimal("1")),
+]
+
+
+def seed_conversions(apps, schema_editor):
+    UnitConversion = apps.get_model("coefficients", "UnitConversion")
+    UnitConversion.objects.bulk_create([
+        UnitConversion(from_unit=from_unit, to_unit=to_unit, factor=factor)
+        for from_unit, to_unit, factor in DEFAULT_CONVERSIONS
+    ])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("coefficients", "0015_seed_coefficient_versions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UnitConversion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("from_unit", models.CharField(max_length=20, verbose_name="导入单位")),
+                (
+                    "to_unit",
+                    models.CharField(
+                        choices=[("KG", "KG"), ("L", "L")],
+                        max_length=20,
+                        verbose_name="目标单位",
+                    ),
+                ),
+                (
+                    "factor",
+                    models.DecimalField(
+                        decimal_places=10, max_digits=20, verbose_name="换算系数"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="创建时间"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新时间"),
+                ),
+            ],
+            options={
+                "verbose_name": "单位换算",
+                "verbose_name_plural": "单位换算",
+                "ordering": ["to_unit", "from_unit"],
+                "unique_together": {("from_unit", "to_unit")},
+            },
+        ),
+        migrations.RunPython(seed_conversions, migrations.RunPython.noop),
+    ]
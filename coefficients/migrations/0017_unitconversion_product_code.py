@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("coefficients", "0016_unitconversion"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="unitconversion",
+            options={
+                "ordering": ["product_code", "to_unit", "from_unit"],
+                "verbose_name": "单位换算",
+                "verbose_name_plural": "单位换算",
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name="unitconversion",
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name="unitconversion",
+            name="product_code",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="留空表示适用于所有产品；箱、盒等包装单位请填写对应的产品编码",
+                max_length=100,
+                verbose_name="产品编码",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="unitconversion",
+            unique_together={("product_code", "from_unit", "to_unit")},
+        ),
+    ]
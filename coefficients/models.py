@@ -118,3 +118,81 @@ class EmissionCoefficient(models.Model):
 
     def __str__(self):
         return f"{self.category_level1} - {self.category_level2}"
+
+    def value_on(self, on_date):
+        """Coefficient in force on on_date, falling back to the current value"""
+        from .versioning import load_version_index, resolve_version
+
+        key = (self.category_level1_id, self.category_level2_id)
+        index = load_version_index(coefficient=self)
+        return resolve_version(index, key, on_date, default=self.coefficient)
+
+    def record_version(self, valid_from=None):
+        """Record the current coefficient value as a version starting at valid_from (None: open start)"""
+        from .versioning import plan_version
+
+        new_version, changed = plan_version(
+            list(self.versions.all()), self.coefficient, valid_from,
+            lambda value, start, end: CoefficientVersion(
+                coefficient=self, value=value, valid_from=start, valid_to=end
+            )
+        )
+        if changed:
+            CoefficientVersion.objects.bulk_update(changed, ['value', 'valid_to'])
+        if new_version is not None:
+            new_version.save()
+
+
+class CoefficientVersion(models.Model):
+    """Effective-dated value of an emission coefficient
+
+    valid_from is inclusive and valid_to exclusive; an empty bound is open.
+    """
+    coefficient = models.ForeignKey(
+        EmissionCoefficient,
+        on_delete=models.CASCADE,
+        verbose_name=_('碳排放系数'),
+        related_name='versions'
+    )
+    value = models.DecimalField(_('系数值'), max_digits=10, decimal_places=6)
+    valid_from = models.DateField(_('生效日期'), null=True, blank=True)
+    valid_to = models.DateField(_('失效日期'), null=True, blank=True)
+    created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('系数版本')
+        verbose_name_plural = _('系数版本')
+        ordering = ['coefficient', 'valid_from']
+        indexes = [
+            models.Index(fields=['coefficient', 'valid_from']),
+        ]
+
+    def __str__(self):
+        return f"{self.coefficient}: {self.value} [{self.valid_from or '-'}, {self.valid_to or '-'})"
+
+
+class UnitConversion(models.Model):
+    """Factor converting a unit used in import files (g, t, mL, ...) into a coefficient unit
+
+    Conversions with a product code apply only to that product, for pack sizes
+    such as cases or boxes; those without one apply to every product.
+    """
+    product_code = models.CharField(
+        _('产品编码'), max_length=100, blank=True, default='',
+        help_text=_('留空表示适用于所有产品；箱、盒等包装单位请填写对应的产品编码'),
+    )
+    from_unit = models.CharField(_('导入单位'), max_length=20)
+    to_unit = models.CharField(_('目标单位'), max_length=20, choices=EmissionCoefficient.UNIT_CHOICES)
+    factor = models.DecimalField(_('换算系数'), max_digits=20, decimal_places=10)
+    created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('单位换算')
+        verbose_name_plural = _('单位换算')
+        ordering = ['product_code', 'to_unit', 'from_unit']
+        unique_together = ['product_code', 'from_unit', 'to_unit']
+
+    def __str__(self):
+        text = f"1 {self.from_unit} = {self.factor.normalize()} {self.to_unit}"
+        return f"{self.product_code}: {text}" if self.product_code else text
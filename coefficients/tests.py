@@ -1,3 +1,141 @@
-from django.test import TestCase
+import io
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .models import CoefficientVersion, EmissionCategory, EmissionCoefficient
+from .versioning import build_version_index, plan_version, resolve_version, version_on
+
+
+def make_version(value, valid_from, valid_to):
+    return SimpleNamespace(value=value, valid_from=valid_from, valid_to=valid_to)
+
+
+class PlanVersionTests(SimpleTestCase):
+    def intervals(self, versions):
+        return sorted(
+            ((v.valid_from, v.valid_to, v.value) for v in versions),
+            key=lambda interval: interval[0] or date.min,
+        )
+
+    def test_first_version_is_open_ended(self):
+        new, changed = plan_version([], Decimal('1'), None, make_version)
+        self.assertEqual((new.valid_from, new.valid_to, new.value), (None, None, Decimal('1')))
+        self.assertEqual(changed, [])
+
+    def test_new_version_closes_the_one_in_force(self):
+        versions = [make_version(Decimal('1'), None, None)]
+        new, changed = plan_version(versions, Decimal('2'), date(2024, 3, 1), make_version)
+        versions.append(new)
+        self.assertEqual(changed, [versions[0]])
+        self.assertEqual(self.intervals(versions), [
+            (None, date(2024, 3, 1), Decimal('1')),
+            (date(2024, 3, 1), None, Decimal('2')),
+        ])
+
+    def test_backdated_version_splits_an_interval_and_ends_at_the_next_start(self):
+        versions = [
+            make_version(Decimal('1'), None, date(2024, 6, 1)),
+            make_version(Decimal('3'), date(2024, 6, 1), None),
+        ]
+        new, changed = plan_version(versions, Decimal('2'), date(2024, 3, 1), make_version)
+        versions.append(new)
+        self.assertEqual(changed, [versions[0]])
+        self.assertEqual(self.intervals(versions), [
+            (None, date(2024, 3, 1), Decimal('1')),
+            (date(2024, 3, 1), date(2024, 6, 1), Decimal('2')),
+            (date(2024, 6, 1), None, Decimal('3')),
+        ])
+
+    def test_same_start_overwrites_the_value(self):
+        versions = [make_version(Decimal('1'), date(2024, 3, 1), None)]
+        new, changed = plan_version(versions, Decimal('5'), date(2024, 3, 1), make_version)
+        self.assertIsNone(new)
+        self.assertEqual(changed, versions)
+        self.assertEqual(versions[0].value, Decimal('5'))
+
+    def test_version_on(self):
+        first = make_version(Decimal('1'), None, date(2024, 3, 1))
+        second = make_version(Decimal('2'), date(2024, 3, 1), None)
+        self.assertIs(version_on([first, second], date(2024, 2, 29)), first)
+        self.assertIs(version_on([first, second], date(2024, 3, 1)), second)
+        self.assertIsNone(version_on([second], date(2024, 1, 1)))
+
+
+class ResolveVersionTests(SimpleTestCase):
+    def setUp(self):
+        self.index = build_version_index([
+            ('k', date(2024, 6, 1), None, Decimal('3')),
+            ('k', None, date(2024, 3, 1), Decimal('1')),
+            ('k', date(2024, 3, 1), date(2024, 5, 1), Decimal('2')),
+        ])
+
+    def test_bounds_are_inclusive_start_exclusive_end(self):
+        self.assertEqual(resolve_version(self.index, 'k', date(2000, 1, 1)), Decimal('1'))
+        self.assertEqual(resolve_version(self.index, 'k', date(2024, 2, 29)), Decimal('1'))
+        self.assertEqual(resolve_version(self.index, 'k', date(2024, 3, 1)), Decimal('2'))
+        self.assertEqual(resolve_version(self.index, 'k', date(2024, 6, 1)), Decimal('3'))
+        self.assertEqual(resolve_version(self.index, 'k', date(2099, 1, 1)), Decimal('3'))
+
+    def test_gaps_unknown_keys_and_missing_dates_use_the_default(self):
+        self.assertEqual(resolve_version(self.index, 'k', date(2024, 5, 15), default='d'), 'd')
+        self.assertEqual(resolve_version(self.index, 'other', date(2024, 1, 1), default='d'), 'd')
+        self.assertEqual(resolve_version(self.index, 'k', None, default='d'), 'd')
+
+
+@override_settings(METRICS_ENABLED=False)
+class CoefficientImportVersionTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user('manager', password='x', can_manage_coefficients=True)
+        self.client.force_login(user)
+
+    def upload(self, rows, on):
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['一级分类', '二级分类', '单位', '碳排放系数', '特殊备注', '生效日期'])
+        for row in rows:
+            sheet.append(row)
+        content = io.BytesIO()
+        workbook.save(content)
+        content.seek(0)
+        content.name = 'coefficients.xlsx'
+        now = datetime(on.year, on.month, on.day, 4, 0, tzinfo=dt_timezone.utc)
+        with mock.patch('coefficients.views.timezone.now', return_value=now):
+            self.client.post(reverse('coefficient_import'), {'file': content})
+
+    def versions(self):
+        return list(CoefficientVersion.objects.order_by('valid_from').values_list('valid_from', 'valid_to', 'value'))
+
+    def test_reimporting_the_same_value_keeps_one_version(self):
+        for day in (20, 21, 22):
+            self.upload([('Fish', 'Cod', 'KG', 3.5)], date(2024, 10, day))
+        self.assertEqual(EmissionCoefficient.objects.get().coefficient, Decimal('3.5'))
+        self.assertEqual(self.versions(), [(None, None, Decimal('3.5'))])
+
+    def test_changed_value_starts_a_version_on_the_local_date(self):
+        self.upload([('Fish', 'Cod', 'KG', 3.5)], date(2024, 10, 20))
+        self.upload([('Fish', 'Cod', 'KG', 4)], date(2024, 10, 21))
+        self.upload([('Fish', 'Cod', 'KG', 4)], date(2024, 10, 22))
+        self.assertEqual(self.versions(), [
+            (None, date(2024, 10, 21), Decimal('3.5')),
+            (date(2024, 10, 21), None, Decimal('4')),
+        ])
+
+    def test_explicit_date_always_records_a_version(self):
+        self.upload([('Fish', 'Cod', 'KG', 3.5)], date(2024, 10, 20))
+        self.upload([('Fish', 'Cod', 'KG', 3.5, '', '2024-01-01')], date(2024, 10, 21))
+        self.assertEqual(self.versions(), [
+            (None, date(2024, 1, 1), Decimal('3.5')),
+            (date(2024, 1, 1), None, Decimal('3.5')),
+        ])
+
+    def test_categories_are_created_once(self):
+        self.upload([('Fish', 'Cod', 'KG', 3.5), ('Fish', 'Salmon', 'KG', 5)], date(2024, 10, 20))
+        self.assertEqual(EmissionCategory.objects.filter(level=1).count(), 1)
+        self.assertEqual(EmissionCoefficient.objects.count(), 2)
@@ -0,0 +1,100 @@
+"""
+Effective-dated coefficient versions.
+
+A version applies from valid_from (inclusive) up to valid_to (exclusive); an
+empty bound is open. The index helpers here only deal with plain tuples so the
+index can be built once per import and shipped to worker processes.
+"""
+from bisect import bisect_right
+from datetime import date
+
+
+def _start(valid_from):
+    return valid_from or date.min
+
+
+def _end(valid_to):
+    return valid_to or date.max
+
+
+def build_version_index(rows):
+    """
+    Build a sorted interval index from (key, valid_from, valid_to, value) rows.
+
+    Returns {key: (starts, ends, values)} with the three tuples sorted by start,
+    ready for resolve_version.
+    """
+    grouped = {}
+    for key, valid_from, valid_to, value in rows:
+        grouped.setdefault(key, []).append((_start(valid_from), _end(valid_to), value))
+
+    index = {}
+    for key, intervals in grouped.items():
+        intervals.sort(key=lambda interval: interval[0])
+        starts, ends, values = zip(*intervals)
+        index[key] = (starts, ends, values)
+    return index
+
+
+def resolve_version(index, key, on_date, default=None):
+    """Return the value in force for key on on_date, or default when no version covers it"""
+    if on_date is None or key not in index:
+        return default
+    starts, ends, values = index[key]
+    position = bisect_right(starts, on_date) - 1
+    if position >= 0 and on_date < ends[position]:
+        return values[position]
+    return default
+
+
+def load_version_index(**filters):
+    """Build the index for all coefficient versions, keyed by (level1 id, level2 id)"""
+    from .models import CoefficientVersion
+
+    rows = CoefficientVersion.objects.filter(**filters).values_list(
+        'coefficient__category_level1_id', 'coefficient__category_level2_id',
+        'valid_from', 'valid_to', 'value'
+    )
+    return build_version_index(
+        ((level1_id, level2_id), valid_from, valid_to, value)
+        for level1_id, level2_id, valid_from, valid_to, value in rows.iterator(chunk_size=2000)
+    )
+
+
+def version_on(versions, on_date):
+    """Return the version among versions (value/valid_from/valid_to objects) in force on on_date, or None"""
+    for version in versions:
+        if _start(version.valid_from) <= on_date < _end(version.valid_to):
+            return version
+    return None
+
+
+def plan_version(versions, value, valid_from, make_version):
+    """
+    Fit a new version starting at valid_from into one coefficient's versions.
+
+    versions is the in-memory list of existing versions (anything with value,
+    valid_from and valid_to attributes). A version starting on the same day is
+    overwritten; the version covering valid_from is closed there, and the new
+    one runs until the next later start. Returns (new version or None, changed
+    existing versions); nothing is saved.
+    """
+    changed = []
+    start = _start(valid_from)
+    for version in versions:
+        if _start(version.valid_from) == start:
+            version.value = value
+            changed.append(version)
+            return None, changed
+
+    valid_to = None
+    for version in versions:
+        version_start = _start(version.valid_from)
+        if version_start > start:
+            if valid_to is None or version_start < valid_to:
+                valid_to = version_start
+        elif start < _end(version.valid_to):
+            version.valid_to = valid_from
+            changed.append(version)
+
+    return make_version(value, valid_from, valid_to), changed
@@ -2,17 +2,22 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
+from django.utils import timezone
 from django.utils.translation import gettext as _
+from django.db import transaction
 from django.db.models import Q
+from django.core.exceptions import ValidationError
 from django.http import HttpResponse, JsonResponse
 from django.core.paginator import Paginator
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill
 from datetime import datetime
+from decimal import Decimal
 import io
 from urllib.parse import quote
 
-from .models import Hotel, EmissionCoefficient, EmissionCategory
+from .models import Hotel, EmissionCoefficient, EmissionCategory, CoefficientVersion
+from .versioning import plan_version, version_on
 from .forms import CustomLoginForm, EmissionCoefficientForm, CoefficientSearchForm
 
 
@@ -208,7 +213,9 @@ def coefficient_create(request):
         if form.is_valid():
             coefficient = form.save(commit=False)
             coefficient.updated_by = request.user
-            coefficient.save()
+            with transaction.atomic():
+                coefficient.save()
+                coefficient.record_version(form.cleaned_data['valid_from'])
             messages.success(request, _('系数添加成功！'))
             return redirect('coefficient_list')
     else:
@@ -233,11 +240,17 @@ def coefficient_edit(request, pk):
     coefficient = get_object_or_404(EmissionCoefficient, pk=pk)
     
     if request.method == 'POST':
+        previous_value = coefficient.coefficient
         form = EmissionCoefficientForm(request.POST, instance=coefficient)
         if form.is_valid():
             coefficient = form.save(commit=False)
             coefficient.updated_by = request.user
-            coefficient.save()
+            valid_from = form.cleaned_data['valid_from']
+            with transaction.atomic():
+                coefficient.save()
+                # A changed value (or an explicit date) starts a new version
+                if valid_from or coefficient.coefficient != previous_value:
+                    coefficient.record_version(valid_from or timezone.localdate())
             messages.success(request, _('系数更新成功！'))
             return redirect('coefficient_list')
     else:
@@ -356,7 +369,7 @@ def coefficient_template(request):
     # Define headers
     headers = [
         _('一级分类'), _('二级分类'),
-        _('单位'), _('碳排放系数'), _('产品举例')
+        _('单位'), _('碳排放系数'), _('产品举例'), _('生效日期')
     ]
     
     # # Style headers
@@ -372,8 +385,8 @@ def coefficient_template(request):
     
     # Add example data
     example_data = [
-        ['Seafood', 'Molluscs, other', 'KG', '7.30', ''],
-        ['Meat', 'Bovine meat', 'KG', '42.80', ''],
+        ['Seafood', 'Molluscs, other', 'KG', '7.30', '', ''],
+        ['Meat', 'Bovine meat', 'KG', '42.80', '', '2024-01-01'],
     ]
     
     for row_num, data in enumerate(example_data, 2):
@@ -408,25 +421,122 @@ def coefficient_template(request):
     return response
 
 
+def _bulk_resolve_categories(rows):
+    """Map the level1/level2 names used by the import rows to categories
+
+    Categories are looked up in memory; missing ones are created with one
+    bulk_create per level. Returns ({level1 name: category},
+    {(level2 name, level1 id): category}).
+    """
+    level1_map = {}
+    for category in EmissionCategory.objects.filter(level=1).order_by('pk'):
+        level1_map.setdefault(category.name, category)
+    missing = {row['level1_name'] for row in rows} - level1_map.keys()
+    if missing:
+        EmissionCategory.objects.bulk_create(
+            [EmissionCategory(name=name, level=1, parent=None) for name in missing]
+        )
+        for category in EmissionCategory.objects.filter(level=1, name__in=missing).order_by('pk'):
+            level1_map.setdefault(category.name, category)
+
+    level2_map = {}
+    for category in EmissionCategory.objects.filter(level=2).order_by('pk'):
+        level2_map.setdefault((category.name, category.parent_id), category)
+    missing = {
+        (row['level2_name'], level1_map[row['level1_name']].pk) for row in rows
+    } - level2_map.keys()
+    if missing:
+        EmissionCategory.objects.bulk_create(
+            [EmissionCategory(name=name, level=2, parent_id=parent_id) for name, parent_id in missing]
+        )
+        for category in EmissionCategory.objects.filter(
+            level=2, parent_id__in={parent_id for _name, parent_id in missing}
+        ).order_by('pk'):
+            level2_map.setdefault((category.name, category.parent_id), category)
+
+    return level1_map, level2_map
+
+
+def _bulk_record_versions(version_rows, previous_values, today):
+    """Apply the coefficient versions of an import in file order
+
+    version_rows: list of ((level1 id, level2 id), row); previous_values maps the
+    pk of every coefficient that existed before the import to its old value. A
+    row without a date only starts a version today when it changes the value in
+    force, as in coefficient_edit. Versions of the affected coefficients are
+    loaded once, planned in memory and written with bulk_update/bulk_create.
+    """
+    coefficients = {
+        (obj.category_level1_id, obj.category_level2_id): obj
+        for obj in EmissionCoefficient.objects.filter(
+            category_level1_id__in={key[0] for key, _row in version_rows},
+            category_level2_id__in={key[1] for key, _row in version_rows},
+        ).order_by('-pk')
+    }
+    versions = {}
+    for version in CoefficientVersion.objects.filter(
+        coefficient__in=[coefficients[key] for key, _row in version_rows]
+    ):
+        versions.setdefault(version.coefficient_id, []).append(version)
+
+    changed = {}
+    to_create = []
+    for key, row in version_rows:
+        coefficient = coefficients[key]
+        valid_from = row['valid_from']
+        current = versions.setdefault(coefficient.pk, [])
+        if valid_from is None and coefficient.pk in previous_values:
+            in_force = version_on(current, today)
+            value = in_force.value if in_force is not None else previous_values[coefficient.pk]
+            if value == row['coefficient']:
+                continue
+            valid_from = today
+        new_version, updated = plan_version(
+            current, row['coefficient'], valid_from,
+            lambda value, start, end: CoefficientVersion(
+                coefficient=coefficient, value=value, valid_from=start, valid_to=end
+            )
+        )
+        for version in updated:
+            if version.pk:
+                changed[version.pk] = version
+        if new_version is not None:
+            current.append(new_version)
+            to_create.append(new_version)
+
+    CoefficientVersion.objects.bulk_update(list(changed.values()), ['value', 'valid_to'], batch_size=500)
+    CoefficientVersion.objects.bulk_create(to_create, batch_size=500)
+
+
 @login_required
 @user_passes_test(can_manage_coefficients, login_url='dashboard')
 def coefficient_import(request):
-    """Import coefficients from Excel"""
+    """Import coefficients from Excel
+
+    Rows are validated in memory first; categories and coefficients are then
+    written with bulk queries in a single transaction. A coefficient listed
+    more than once takes the values of its last row. Every row also records a
+    coefficient version from its optional 生效日期 (empty: all dates for a new
+    coefficient, today for an existing one whose value changes).
+    """
     if request.method == 'POST' and request.FILES.get('file'):
         excel_file = request.FILES['file']
         
         try:
-            wb = openpyxl.load_workbook(excel_file)
+            wb = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
             ws = wb.active
+            coefficient_field = EmissionCoefficient._meta.get_field('coefficient')
             
-            success_count = 0
             error_count = 0
             errors = []
+            rows = []
             
             # Skip header row
             for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
                 try:
-                    level1_name, level2_name, unit, coefficient, special_note = row[:5]
+                    level1_name, level2_name, unit, coefficient, special_note, valid_from = (
+                        tuple(row) + (None,) * 6
+                    )[:6]
                     
                     # Validation
                     if coefficient is None:
@@ -438,35 +548,84 @@ def coefficient_import(request):
                         error_count += 1
                         continue
                     
-                    # Get or create categories
-                    level1_category, created = EmissionCategory.objects.get_or_create(
-                        name=level1_name,
-                        level=1,
-                        defaults={'parent': None}
-                    )
+                    try:
+                        coefficient = coefficient_field.clean(Decimal(str(float(coefficient))), None)
+                    except ValidationError as e:
+                        raise ValueError('; '.join(e.messages))
                     
-                    level2_category, created = EmissionCategory.objects.get_or_create(
-                        name=level2_name,
-                        level=2,
-                        parent=level1_category
-                    )
+                    if isinstance(valid_from, datetime):
+                        valid_from = valid_from.date()
+                    elif valid_from not in (None, ''):
+                        try:
+                            valid_from = datetime.strptime(str(valid_from).strip(), '%Y-%m-%d').date()
+                        except ValueError:
+                            errors.append(f"第{row_num}行: 生效日期格式错误: {valid_from}")
+                            error_count += 1
+                            continue
+                    else:
+                        valid_from = None
                     
-                    # Create or update coefficient
-                    EmissionCoefficient.objects.update_or_create(
-                        category_level1=level1_category,
-                        category_level2=level2_category,
-                        defaults={
-                            'unit': unit,
-                            'coefficient': float(coefficient),
-                            'special_note': special_note or '',
-                            'updated_by': request.user,
-                        }
-                    )
-                    success_count += 1
+                    rows.append({
+                        'level1_name': str(level1_name),
+                        'level2_name': str(level2_name),
+                        'unit': unit,
+                        'coefficient': coefficient,
+                        'special_note': special_note or '',
+                        'valid_from': valid_from,
+                    })
 
                 except Exception as e:
                     errors.append(f"第{row_num}行: {str(e)}")
                     error_count += 1
+            wb.close()
+            
+            success_count = len(rows)
+            if rows:
+                now = timezone.now()
+                with transaction.atomic():
+                    level1_map, level2_map = _bulk_resolve_categories(rows)
+                    
+                    existing = {}
+                    for coefficient in EmissionCoefficient.objects.order_by('pk'):
+                        existing.setdefault(
+                            (coefficient.category_level1_id, coefficient.category_level2_id), coefficient
+                        )
+                    
+                    # Later rows overwrite earlier ones for the same category pair
+                    pending = {}
+                    version_rows = []
+                    for row in rows:
+                        level1_category = level1_map[row['level1_name']]
+                        level2_category = level2_map[(row['level2_name'], level1_category.pk)]
+                        key = (level1_category.pk, level2_category.pk)
+                        pending[key] = row
+                        version_rows.append((key, row))
+                    
+                    to_create = []
+                    to_update = []
+                    previous_values = {}
+                    for (level1_id, level2_id), row in pending.items():
+                        obj = existing.get((level1_id, level2_id))
+                        if obj is None:
+                            obj = EmissionCoefficient(category_level1_id=level1_id, category_level2_id=level2_id)
+                            to_create.append(obj)
+                        else:
+                            to_update.append(obj)
+                            previous_values.setdefault(obj.pk, obj.coefficient)
+                        obj.unit = row['unit']
+                        obj.coefficient = row['coefficient']
+                        obj.special_note = row['special_note']
+                        obj.updated_by = request.user
+                        # bulk_update skips auto_now, so stamp it explicitly
+                        obj.updated_at = now
+                    
+                    EmissionCoefficient.objects.bulk_create(to_create, batch_size=500)
+                    EmissionCoefficient.objects.bulk_update(
+                        to_update,
+                        ['unit', 'coefficient', 'special_note', 'updated_by', 'updated_at'],
+                        batch_size=500
+                    )
+                    _bulk_record_versions(version_rows, previous_values, timezone.localdate(now))
             
             # Show results
             if success_count > 0:
@@ -2,7 +2,7 @@ from django.shortcuts import render
 from django.utils.translation import gettext_lazy as _
 from django.utils.encoding import force_str
 from django.db.models import Sum, Count, F
-from data_entry.models import MaterialConsumption, ConsumerData, DEPARTMENT_CHOICES
+from data_entry.models import MaterialConsumption, ConsumerData, MonthlyRestaurantStats, DEPARTMENT_CHOICES
 from coefficients.models import EmissionCoefficient, EmissionCategory
 from datetime import datetime, timedelta
 from collections import defaultdict
@@ -156,38 +156,20 @@ def dashboard_view(request):
                 'name': cat2.name
             })
     
-    # Query consumer data for adjusted daily carbon emission chart
-    consumer_data = ConsumerData.objects.filter(
+    # Query consumer data for adjusted daily carbon emission chart, joined to
+    # the monthly totals of each row's restaurant and month
+    consumer_data = MonthlyRestaurantStats.annotate_consumers(ConsumerData.objects.filter(
         order_date__range=[start_date, end_date]
-    ).order_by('order_date')
+    )).order_by('order_date')
     
     # Calculate adjusted daily carbon emission for each record
     adjusted_daily_stats = defaultdict(lambda: Decimal('0'))
     
     for consumer in consumer_data:
-        # Get the year and month of this record
-        year = consumer.order_date.year
-        month = consumer.order_date.month
-        
-        # Query all records for the same restaurant and month
-        monthly_data = ConsumerData.objects.filter(
-            restaurant=consumer.restaurant,
-            order_date__year=year,
-            order_date__month=month
-        ).aggregate(
-            total_emission=Sum('daily_carbon_emission'),
-            total_consumers=Sum('consumer_count')
-        )
-        
-        # Calculate adjusted carbon emission
-        total_emission = monthly_data['total_emission'] or Decimal('0')
-        total_consumers = monthly_data['total_consumers'] or 0
-        
-        if total_consumers > 0:
+        if consumer.month_total_consumers:
             # Formula: (当月总碳排 / 当月总人数) × 当日消费者人数
-            adjusted_emission = (total_emission / Decimal(total_consumers)) * Decimal(consumer.consumer_count)
             date_key = consumer.order_date.strftime('%Y-%m-%d')
-            adjusted_daily_stats[date_key] += adjusted_emission
+            adjusted_daily_stats[date_key] += consumer.adjusted_daily_carbon_emission
     
     # Prepare adjusted daily carbon emission data
     adjusted_dates = sorted(adjusted_daily_stats.keys())
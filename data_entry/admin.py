@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.db import connection
+from .consumer_refresh import mark_dirty
 from .models import MaterialConsumption
 
 
@@ -109,18 +110,34 @@ class MaterialConsumptionAdmin(admin.ModelAdmin):
         self.message_user(request, f"已选择 {queryset.count()} 条记录进行导出")
     export_selected_records.short_description = "导出选中的记录"
 
+    def delete_queryset(self, request, queryset):
+        # QuerySet.delete() skips MaterialConsumption.delete, so refresh the daily totals here
+        keys = set(queryset.values_list('restaurant', 'order_date').distinct())
+        super().delete_queryset(request, queryset)
+        mark_dirty(keys)
+
     def fast_delete_selected(self, request, queryset):
         """Delete selected records in batches via direct SQL, avoiding ORM cascade queries"""
-        table = MaterialConsumption._meta.db_table
+        table = connection.ops.quote_name(MaterialConsumption._meta.db_table)
+        keys = set(queryset.values_list('restaurant', 'order_date').distinct())
         ids = list(queryset.values_list('pk', flat=True))
         total = len(ids)
-        batch_size = 5000
         deleted = 0
         with connection.cursor() as cursor:
-            for i in range(0, total, batch_size):
-                batch = ids[i:i + batch_size]
-                placeholders = ','.join(['%s'] * len(batch))
-                cursor.execute(f'DELETE FROM "{table}" WHERE id IN ({placeholders})', batch)
-                deleted += len(batch)
+            if connection.vendor == 'postgresql':
+                # One array parameter per statement, so batches are not bound by the parameter limit
+                batch_size = 50000
+                for i in range(0, total, batch_size):
+                    batch = ids[i:i + batch_size]
+                    cursor.execute(f'DELETE FROM {table} WHERE id = ANY(%s)', [batch])
+                    deleted += len(batch)
+            else:
+                batch_size = 5000
+                for i in range(0, total, batch_size):
+                    batch = ids[i:i + batch_size]
+                    placeholders = ','.join(['%s'] * len(batch))
+                    cursor.execute(f'DELETE FROM {table} WHERE id IN ({placeholders})', batch)
+                    deleted += len(batch)
+        mark_dirty(keys)
         self.message_user(request, f"已成功删除 {deleted} 条记录。")
     fast_delete_selected.short_description = "快速删除选中记录（大批量）"
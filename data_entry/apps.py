@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class DataEntryConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "data_entry"
+
+    def ready(self):
+        from carbon_management.db import configure_sqlite
+
+        connection_created.connect(configure_sqlite, dispatch_uid='configure_sqlite')
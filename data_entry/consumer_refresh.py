@@ -0,0 +1,76 @@
+"""
+Coalesced recomputation of ConsumerData.daily_carbon_emission.
+
+Writers report the (restaurant, order_date) keys they touched with mark_dirty.
+Inside an atomic block, or a defer_consumer_refresh() block, the keys are only
+collected; one batched ConsumerData.refresh_daily_emissions runs when the
+outermost transaction commits (or when the defer block exits in autocommit).
+Keys are kept per thread, so background import threads collect their own.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+from carbon_management.db import retry_on_lock
+
+_state = threading.local()
+
+
+def _pending():
+    if not hasattr(_state, 'keys'):
+        _state.keys = set()
+        _state.depth = 0
+    return _state.keys
+
+
+def collecting():
+    """True when writes should mark keys dirty instead of updating ConsumerData right away"""
+    _pending()
+    return _state.depth > 0 or connection.in_atomic_block
+
+
+def mark_dirty(keys):
+    """Record (restaurant, order_date) keys whose daily totals need recomputing"""
+    pending = _pending()
+    pending.update((restaurant, order_date) for restaurant, order_date in keys if order_date)
+    if pending and _state.depth == 0:
+        _schedule_flush()
+
+
+def _schedule_flush():
+    if connection.in_atomic_block:
+        # Every registration flushes everything pending, so extra callbacks are cheap
+        # no-ops; callbacks dropped by a rollback leave the keys for the next flush.
+        transaction.on_commit(flush)
+    else:
+        flush()
+
+
+def flush():
+    """Recompute all pending keys with one grouped query and bulk update"""
+    from .models import ConsumerData
+
+    pending = _pending()
+    if not pending:
+        return 0
+    keys = set(pending)
+    pending.clear()
+    return retry_on_lock(ConsumerData.refresh_daily_emissions)(keys)
+
+
+@contextmanager
+def defer_consumer_refresh():
+    """Collect dirty keys for the duration of the block and recompute them once at the end
+
+    For views, admin actions, management commands and importers that write many
+    rows. When the block exits inside a transaction the recompute waits for commit.
+    """
+    _pending()
+    _state.depth += 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+        if _state.depth == 0 and _state.keys:
+            _schedule_flush()
@@ -1,6 +1,6 @@
 from django import forms
 from django.utils.translation import gettext_lazy as _
-from .models import MaterialConsumption, ConsumerData
+from .models import MaterialConsumption, ConsumerData, ImportTask
 from coefficients.models import EmissionCoefficient, EmissionCategory
 import pandas as pd
 from datetime import datetime
@@ -116,7 +116,7 @@ class MaterialConsumptionForm(forms.ModelForm):
 
             # Store product information
             cleaned_data['product_unit'] = coefficient.unit
-            cleaned_data['emission_coefficient'] = coefficient.coefficient
+            cleaned_data['emission_coefficient'] = coefficient.value_on(cleaned_data.get('order_date'))
             
         except EmissionCoefficient.DoesNotExist:
             raise forms.ValidationError(_('产品编号不存在或与所选分类不匹配'))
@@ -155,6 +155,34 @@ class DataImportForm(forms.Form):
         }),
         help_text=_('支持 Excel (.xlsx, .xls) 和 CSV (.csv) 格式')
     )
+
+    mode = forms.ChoiceField(
+        label=_('导入模式'),
+        choices=ImportTask.MODE_CHOICES,
+        initial=ImportTask.MODE_APPEND,
+        widget=forms.Select(attrs={
+            'class': 'form-select'
+        }),
+        help_text=_('替换模式会先删除文件中每个餐厅在其日期范围内的已有记录，再写入新数据')
+    )
+
+    validate_only = forms.BooleanField(
+        label=_('仅校验（不写入数据）'),
+        required=False,
+        widget=forms.CheckboxInput(attrs={
+            'class': 'form-check-input'
+        }),
+        help_text=_('只检查数据并生成失败报告，不导入任何记录')
+    )
+
+    force = forms.BooleanField(
+        label=_('强制重新导入'),
+        required=False,
+        widget=forms.CheckboxInput(attrs={
+            'class': 'form-check-input'
+        }),
+        help_text=_('相同内容的文件已导入过时仍然重新处理')
+    )
     
     def clean_file(self):
         file = self.cleaned_data.get('file')
@@ -261,6 +289,15 @@ class ConsumerDataImportForm(forms.Form):
         }),
         help_text=_('支持 Excel (.xlsx, .xls) 和 CSV (.csv) 格式')
     )
+
+    force = forms.BooleanField(
+        label=_('强制重新导入'),
+        required=False,
+        widget=forms.CheckboxInput(attrs={
+            'class': 'form-check-input'
+        }),
+        help_text=_('相同内容的文件已导入过时仍然重新处理')
+    )
     
     def clean_file(self):
         file = self.cleaned_data.get('file')
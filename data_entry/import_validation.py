@@ -0,0 +1,288 @@
+"""
+Row validation for material consumption imports.
+
+This module deliberately avoids importing any models: it only works on plain
+lookup dictionaries built by the caller, so the same code runs in the request
+thread and inside ProcessPoolExecutor workers started with the spawn method.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.core.exceptions import ValidationError
+from django.core.validators import DecimalValidator
+from django.utils.translation import gettext
+
+from coefficients.versioning import resolve_version
+
+# Read-only lookups installed in each worker process by init_import_worker
+_worker_lookups = None
+
+
+def init_import_worker(lookups):
+    """ProcessPoolExecutor initializer: set up Django and install the shared lookups"""
+    global _worker_lookups
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    _worker_lookups = lookups
+
+
+def parse_date(val):
+    """Parse a date value from various formats, return date or raise ValueError."""
+    if isinstance(val, str):
+        date_str = val.strip()
+        for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d'):
+            try:
+                return datetime.strptime(date_str, fmt).date()
+            except ValueError:
+                continue
+        raise ValueError(date_str)
+    return pd.to_datetime(val).date()
+
+
+def parse_time(val):
+    """Parse a time value, return time or raise ValueError."""
+    from datetime import time as time_type
+    if isinstance(val, time_type):
+        return val
+    if isinstance(val, str):
+        time_str = val.strip()
+        try:
+            return datetime.strptime(time_str, '%H:%M:%S').time()
+        except ValueError:
+            return datetime.strptime(time_str, '%H:%M').time()
+    if hasattr(val, 'time'):
+        return val.time() if callable(val.time) else val.time
+    return pd.to_datetime(val).time()
+
+
+def apply_unit_conversion(df, lookups):
+    """
+    Normalize quantities given in the optional 'unit' column to the coefficient unit.
+
+    The target unit of every row comes from a merge on its category names and the
+    factor from a merge on (product code, unit, target unit), falling back to the
+    conversions without a product code, so each group is converted by one vectorized
+    multiply instead of a Python step per row. Rows whose
+    unit cannot be converted keep their quantity and get '_unit_error' set to the
+    unit for validate_import_rows to report; rows with unknown categories are left
+    to the category checks.
+    """
+    if 'unit' not in df.columns:
+        return df
+
+    level1_names = {pk: name for name, pk in lookups['level1'].items()}
+    targets = pd.DataFrame(
+        [
+            (level1_names[level1_id], level2_name, lookups['coefficients'][(level1_id, level2_id)][0])
+            for (level2_name, level1_id), level2_id in lookups['level2'].items()
+            if level1_id in level1_names and (level1_id, level2_id) in lookups['coefficients']
+        ],
+        columns=['category_level1', 'category_level2', '_target_unit'],
+    )
+    conversions = pd.DataFrame(
+        [
+            (product_code, from_unit, to_unit, float(factor))
+            for (product_code, from_unit, to_unit), factor in lookups['unit_conversions'].items()
+        ],
+        columns=['_product_code', '_unit_key', '_target_unit', '_factor'],
+    )
+    product_conversions = conversions[conversions['_product_code'] != '']
+    generic_conversions = conversions[conversions['_product_code'] == ''].drop(columns='_product_code')
+
+    units = df['unit'].where(df['unit'].notna(), '').astype(str).str.strip()
+    keys = pd.DataFrame({
+        'category_level1': df['category_level1'].astype(str).str.strip().to_numpy(),
+        'category_level2': df['category_level2'].astype(str).str.strip().to_numpy(),
+        '_unit_key': units.str.lower().to_numpy(),
+        '_product_code': df['product_code'].where(df['product_code'].notna(), '').astype(str).str.strip().to_numpy(),
+    })
+    # Left merges keep the row order of keys, so results line up with df by position
+    merged = keys.merge(targets, how='left', on=['category_level1', 'category_level2'])
+    merged = merged.merge(product_conversions, how='left', on=['_product_code', '_unit_key', '_target_unit'])
+    merged = merged.merge(
+        generic_conversions, how='left', on=['_unit_key', '_target_unit'], suffixes=('', '_generic')
+    )
+
+    same_unit = merged['_unit_key'] == merged['_target_unit'].fillna('').astype(str).str.lower()
+    factor = (
+        merged['_factor'].fillna(merged['_factor_generic']).astype(float).mask(same_unit, 1.0).to_numpy()
+    )
+    given = (merged['_unit_key'] != '').to_numpy()
+    known_target = merged['_target_unit'].notna().to_numpy()
+    quantity = pd.to_numeric(df['quantity'], errors='coerce').to_numpy(dtype=float)
+
+    convert = given & known_target & ~np.isnan(factor) & ~np.isnan(quantity)
+    values = df['quantity'].to_numpy(dtype=object).copy()
+    values[convert] = np.round(quantity[convert] * factor[convert], 6)
+
+    df = df.copy()
+    df['quantity'] = values
+    df['_unit_error'] = np.where(given & known_target & np.isnan(factor), units.to_numpy(), None)
+    return df
+
+
+def validate_import_rows(records, lookups=None):
+    """
+    Validate a shard of import rows.
+
+    records: list of (row_num, row dict) using the renamed English column keys.
+    lookups: dict with 'level1' {name: id}, 'level2' {(name, parent_id): id},
+             'coefficients' {(level1_id, level2_id): (unit, coefficient)} and
+             'versions', the coefficient version index keyed the same way, and
+             'quantity_digits', (max_digits, decimal_places) of the quantity column;
+             defaults to the lookups installed by init_import_worker.
+
+    Returns (valid, errors): valid is a list of (row_num, field values) ready for
+    MaterialConsumption, errors a list of {'row', 'error'} dicts, both in row order.
+    Duplicate detection is left to the single writer since it depends on the
+    rows accepted before this shard.
+    """
+    if lookups is None:
+        lookups = _worker_lookups
+    level1_map = lookups['level1']
+    level2_map = lookups['level2']
+    coeff_map = lookups['coefficients']
+    version_index = lookups.get('versions', {})
+    max_digits, decimal_places = lookups['quantity_digits']
+    quantity_validator = DecimalValidator(max_digits, decimal_places)
+    quantity_quantum = Decimal(1).scaleb(-decimal_places)
+
+    valid = []
+    errors = []
+    for row_num, row in records:
+        try:
+            # Restaurant
+            restaurant = str(row['restaurant']).strip()
+            if not restaurant:
+                errors.append({'row': row_num, 'error': gettext('餐厅不能为空')})
+                continue
+
+            # Categories (in-memory lookup)
+            level1_name = str(row['category_level1']).strip()
+            level2_name = str(row['category_level2']).strip()
+
+            level1_id = level1_map.get(level1_name)
+            if not level1_id:
+                errors.append({
+                    'row': row_num,
+                    'error': gettext('一级分类 "%(category)s" 不存在') % {'category': level1_name}
+                })
+                continue
+
+            level2_id = level2_map.get((level2_name, level1_id))
+            if not level2_id:
+                errors.append({
+                    'row': row_num,
+                    'error': gettext('二级分类 "%(level2)s" 不存在或不属于 "%(level1)s"') % {
+                        'level2': level2_name, 'level1': level1_name
+                    }
+                })
+                continue
+
+            # Product code
+            product_code = str(row['product_code']).strip() if pd.notna(row.get('product_code')) else ''
+            if not product_code:
+                errors.append({'row': row_num, 'error': gettext('产品编码不能为空')})
+                continue
+
+            product_name = str(row['product_name']).strip()
+
+            # Coefficient (in-memory lookup)
+            coefficient = coeff_map.get((level1_id, level2_id))
+            if not coefficient:
+                errors.append({'row': row_num, 'error': gettext('未找到匹配的碳排放系数')})
+                continue
+
+            product_unit, current_coefficient = coefficient
+
+            if row.get('_unit_error'):
+                errors.append({
+                    'row': row_num,
+                    'error': gettext('单位 "%(unit)s" 无法换算为 %(target)s') % {
+                        'unit': row['_unit_error'], 'target': product_unit
+                    }
+                })
+                continue
+
+            # Parse date
+            order_date = None
+            if pd.notna(row['order_date']):
+                try:
+                    order_date = parse_date(row['order_date'])
+                except Exception:
+                    errors.append({
+                        'row': row_num,
+                        'error': gettext('日期格式错误：%(date)s') % {'date': row['order_date']}
+                    })
+                    continue
+
+            # Version in force on the order date, else the current value
+            emission_coefficient = resolve_version(
+                version_index, (level1_id, level2_id), order_date, default=current_coefficient
+            )
+
+            # Parse time (optional)
+            consumption_time = None
+            if pd.notna(row.get('consumption_time')):
+                try:
+                    consumption_time = parse_time(row['consumption_time'])
+                except Exception:
+                    errors.append({
+                        'row': row_num,
+                        'error': gettext('时间格式错误：%(time)s') % {'time': str(row['consumption_time'])}
+                    })
+                    continue
+
+            # Parse quantity
+            try:
+                quantity = float(row['quantity'])
+                if quantity < 0:
+                    errors.append({'row': row_num, 'error': gettext('消耗数量不能为负数')})
+                    continue
+            except Exception:
+                errors.append({
+                    'row': row_num,
+                    'error': gettext('消耗数量格式错误：%(quantity)s') % {'quantity': row['quantity']}
+                })
+                continue
+
+            # The (possibly unit-converted) quantity must fit the column, or the
+            # database rejects the whole chunk instead of this one row
+            quantity = Decimal(str(quantity))
+            if quantity.is_finite() and quantity.adjusted() < max_digits:
+                quantity = quantity.quantize(quantity_quantum)
+            try:
+                quantity_validator(quantity)
+            except ValidationError as e:
+                errors.append({
+                    'row': row_num,
+                    'error': gettext('消耗数量 %(quantity)s %(unit)s 超出范围：%(reason)s') % {
+                        'quantity': quantity, 'unit': product_unit, 'reason': '; '.join(e.messages)
+                    }
+                })
+                continue
+
+            valid.append((row_num, {
+                'restaurant': restaurant,
+                'product_code': product_code,
+                'category_level1_id': level1_id,
+                'category_level2_id': level2_id,
+                'product_name': product_name,
+                'order_date': order_date,
+                'consumption_time': consumption_time,
+                'quantity': quantity,
+                'product_unit': product_unit,
+                'emission_coefficient': emission_coefficient,
+            }))
+
+        except Exception as e:
+            errors.append({
+                'row': row_num,
+                'error': gettext('处理失败：%(error)s') % {'error': str(e)}
+            })
+
+    return valid, errors
@@ -0,0 +1,242 @@
+import json
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from data_entry import synthetic
+from data_entry.models import ConsumerData, MaterialConsumption, MonthlyRestaurantStats
+from data_entry.views import process_consumer_import_data, process_import_data
+
+SCENARIOS = [
+    'dashboard', 'data_customization', 'consumption_list_first', 'consumption_list_last',
+    'consumer_list', 'export', 'material_import', 'consumer_import',
+]
+
+
+class QueryCounter:
+    """connection.execute_wrapper hook counting the queries of one timed run"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = '在全新的临时数据库中按指定规模生成数据并运行性能基准测试，结果写入 JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, nargs='+', default=[100000],
+            help='物料消耗记录规模，可指定多个，例如 --rows 100000 1000000 5000000'
+        )
+        parser.add_argument('--repeat', type=int, default=3, help='每个场景计时的次数（取中位数）')
+        parser.add_argument('--import-rows', type=int, default=10000, help='导入场景的文件行数')
+        parser.add_argument('--export-rows', type=int, default=5000, help='导出场景选中的记录数')
+        parser.add_argument('--seed', type=int, default=0, help='随机种子，保证数据可复现')
+        parser.add_argument('--only', nargs='+', choices=SCENARIOS, help='只运行指定场景')
+        parser.add_argument('--output', default='benchmark-results.json', help='结果 JSON 文件路径')
+        parser.add_argument('--baseline', help='与之对比的基准结果 JSON 文件')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='中位数超过基准的比例阈值（默认 20%%）')
+        parser.add_argument('--fail-on-regression', action='store_true', help='存在性能回退时以错误退出')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat 必须大于等于 1')
+        baseline = None
+        if options['baseline']:
+            try:
+                baseline = json.loads(Path(options['baseline']).read_text(encoding='utf-8'))
+            except (OSError, ValueError) as e:
+                raise CommandError(f'无法读取基准文件：{e}')
+
+        results = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'repeat': options['repeat'],
+            'import_rows': options['import_rows'],
+            'export_rows': options['export_rows'],
+            'seed': options['seed'],
+            'scales': {},
+        }
+        scenarios = options['only'] or SCENARIOS
+
+        # Metrics, slow-request logging and host checks would only add noise here
+        with override_settings(
+            METRICS_ENABLED=False, PERFORMANCE_SLOW_REQUEST_MS=10 ** 9, ALLOWED_HOSTS=['*'], DEBUG=False
+        ):
+            for rows in options['rows']:
+                self.stdout.write(self.style.MIGRATE_HEADING(f'\n规模：{rows:,} 条物料消耗记录'))
+                results['scales'][str(rows)] = self.run_scale(rows, scenarios, options)
+
+        output = Path(options['output'])
+        output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+        self.stdout.write(self.style.SUCCESS(f'\n结果已写入 {output}'))
+
+        if baseline is not None:
+            regressions = self.compare(results, baseline, options['tolerance'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{regressions} 个场景性能回退超过 {options["tolerance"]:.0%}')
+
+    def run_scale(self, rows, scenarios, options):
+        """Seed a fresh test database with rows records and time every scenario against it"""
+        creation = connection.creation
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        old_test_name = test_settings.get('NAME')
+        tmp_dir = None
+        if connection.vendor == 'sqlite' and not old_test_name:
+            # The default SQLite test database lives in memory, which says nothing about disk I/O
+            tmp_dir = tempfile.TemporaryDirectory()
+            test_settings['NAME'] = str(Path(tmp_dir.name) / 'benchmark.sqlite3')
+        old_name = creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            started = time.perf_counter()
+            consumer_rows = synthetic.seed(rows, seed=options['seed'], progress=self.seed_progress(rows))
+            seed_seconds = time.perf_counter() - started
+            self.stdout.write(f'  生成数据：{seed_seconds:.1f}s（{consumer_rows:,} 条消费者数据）')
+
+            client = Client()
+            user = get_user_model().objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+            client.force_login(user)
+
+            timings = {}
+            for name in scenarios:
+                run, teardown = getattr(self, f'scenario_{name}')(client, options)
+                timings[name] = self.measure(name, run, teardown, options['repeat'])
+            return {'seed_seconds': round(seed_seconds, 3), 'consumer_rows': consumer_rows, 'scenarios': timings}
+        finally:
+            creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = old_test_name
+            if tmp_dir is not None:
+                tmp_dir.cleanup()
+
+    def seed_progress(self, rows):
+        def progress(done):
+            self.stdout.write(f'  已写入 {done:,} / {rows:,}', ending='\n' if done == rows else '\r')
+            self.stdout.flush()
+        return progress
+
+    def measure(self, name, run, teardown, repeat):
+        """One untimed warm-up run, then repeat timed runs; returns seconds and query counts"""
+        samples = []
+        queries = 0
+        for attempt in range(repeat + 1):
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - started
+            teardown()
+            if attempt:
+                samples.append(elapsed)
+                queries = counter.count
+        result = {
+            'median': round(statistics.median(samples), 4),
+            'min': round(min(samples), 4),
+            'max': round(max(samples), 4),
+            'queries': queries,
+        }
+        self.stdout.write(
+            f'  {name:<24} 中位数 {result["median"]:.3f}s  '
+            f'(最小 {result["min"]:.3f}s / 最大 {result["max"]:.3f}s, {queries} 次查询)'
+        )
+        return result
+
+    # Scenarios: each returns (run, teardown); only run is timed, teardown undoes its writes
+
+    @staticmethod
+    def _nothing():
+        pass
+
+    def _get(self, client, url, data=None):
+        def run():
+            response = client.get(url, data or {})
+            if response.status_code != 200:
+                raise CommandError(f'{url} 返回 {response.status_code}')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return run, self._nothing
+
+    def scenario_dashboard(self, client, options):
+        return self._get(client, '/dashboard/')
+
+    def scenario_data_customization(self, client, options):
+        return self._get(client, '/dashboard/customization/')
+
+    def scenario_consumption_list_first(self, client, options):
+        return self._get(client, '/data-entry/')
+
+    def scenario_consumption_list_last(self, client, options):
+        last_page = max((MaterialConsumption.objects.count() + 19) // 20, 1)
+        return self._get(client, '/data-entry/', {'page': last_page})
+
+    def scenario_consumer_list(self, client, options):
+        return self._get(client, '/data-entry/consumer/')
+
+    def scenario_export(self, client, options):
+        ids = MaterialConsumption.objects.order_by('pk').values_list('pk', flat=True)[:options['export_rows']]
+        return self._get(client, '/data-entry/export/', {'ids': ','.join(map(str, ids))})
+
+    def scenario_material_import(self, client, options):
+        frame = synthetic.material_import_frame(options['import_rows'], seed=options['seed'])
+        restaurants = set(frame['餐厅'])
+
+        def run():
+            result = process_import_data(frame.copy())
+            if not result['success'] or result['error_count']:
+                raise CommandError(f'物料导入失败：{result.get("error") or result["errors"][:3]}')
+
+        def teardown():
+            MaterialConsumption.objects.filter(restaurant__in=restaurants).delete()
+            ConsumerData.objects.filter(restaurant__in=restaurants).delete()
+        return run, teardown
+
+    def scenario_consumer_import(self, client, options):
+        frame = synthetic.consumer_import_frame()
+        restaurants = set(frame['餐厅'])
+
+        def run():
+            result = process_consumer_import_data(frame.copy())
+            if not result['success'] or result['error_count']:
+                raise CommandError(f'消费者数据导入失败：{result.get("error") or result["errors"][:3]}')
+
+        def teardown():
+            ConsumerData.objects.filter(restaurant__in=restaurants).delete()
+            MonthlyRestaurantStats.objects.filter(restaurant__in=restaurants).delete()
+        return run, teardown
+
+    def compare(self, results, baseline, tolerance):
+        """Print median changes against baseline; returns the number of regressions"""
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n与基准对比（{baseline.get("created", "?")}）'))
+        regressions = 0
+        for scale, current in results['scales'].items():
+            previous = baseline.get('scales', {}).get(scale)
+            if not previous:
+                self.stdout.write(f'  {scale}: 基准中没有该规模，跳过')
+                continue
+            for name, timing in current['scenarios'].items():
+                before = previous.get('scenarios', {}).get(name)
+                if not before or not before['median']:
+                    continue
+                ratio = timing['median'] / before['median']
+                line = f'  {scale:>9} {name:<24} {before["median"]:.3f}s → {timing["median"]:.3f}s ({ratio - 1:+.0%})'
+                if ratio > 1 + tolerance:
+                    regressions += 1
+                    self.stdout.write(self.style.ERROR(line))
+                elif ratio < 1 - tolerance:
+                    self.stdout.write(self.style.SUCCESS(line))
+                else:
+                    self.stdout.write(line)
+        return regressions
@@ -2,16 +2,17 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import datetime, timedelta
 from decimal import Decimal
+from data_entry.consumer_refresh import defer_consumer_refresh
 from data_entry.models import MaterialConsumption
 from coefficients.models import EmissionCoefficient, EmissionCategory
 
 
 class Command(BaseCommand):
-    help = '创建20条测试物料消耗记录'
+    help = '创建20条测试物料消耗记录（大规模数据请使用 generate_synthetic_data）'
 
     def handle(self, *args, **options):
         # 获取一些现有的系数数据
-        coefficients = EmissionCoefficient.objects.all()[:20]
+        coefficients = EmissionCoefficient.objects.select_related('category_level1', 'category_level2')[:20]
         
         if not coefficients.exists():
             self.stdout.write(self.style.ERROR('没有找到碳排放系数数据，请先添加系数数据'))
@@ -47,43 +48,41 @@ class Command(BaseCommand):
         created_count = 0
         base_date = datetime.now().date()
         
-        for i, coeff in enumerate(coefficients[:20]):
-            try:
-                # 计算日期范围
-                start_date = base_date - timedelta(days=i*3)
-                end_date = start_date + timedelta(days=2)
+        # Daily consumer totals are recomputed once after the loop
+        with defer_consumer_refresh():
+            for i, coeff in enumerate(coefficients[:20]):
+                try:
+                    order_date = base_date - timedelta(days=i*3)
                 
-                # 随机数量
-                quantity = Decimal(str(10 + i * 5))
+                    # 随机数量
+                    quantity = Decimal(str(10 + i * 5))
                 
-                consumption = MaterialConsumption.objects.create(
-                    hotel_name=hotels[i],
-                    department=coeff.department,
-                    product_name=coeff.product_name,
-                    category_level1=coeff.category_level1,
-                    category_level2=coeff.category_level2,
-                    product_unit=coeff.unit,
-                    emission_coefficient=coeff.coefficient,
-                    consumption_date_start=start_date,
-                    consumption_date_end=end_date,
-                    consumption_time_start=datetime.strptime('08:00', '%H:%M').time(),
-                    consumption_time_end=datetime.strptime('18:00', '%H:%M').time(),
-                    quantity=quantity,
-                    notes=f'测试数据 #{i+1}'
-                )
+                    consumption = MaterialConsumption.objects.create(
+                        restaurant=hotels[i],
+                        product_code=f'TEST{i+1:03d}',
+                        product_name=coeff.category_level2.name,
+                        category_level1=coeff.category_level1,
+                        category_level2=coeff.category_level2,
+                        product_unit=coeff.unit,
+                        emission_coefficient=coeff.coefficient,
+                        order_date=order_date,
+                        consumption_time=datetime.strptime('12:00', '%H:%M').time(),
+                        quantity=quantity,
+                        special_note=f'测试数据 #{i+1}'
+                    )
                 
-                created_count += 1
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'创建消耗记录 {i+1}: {consumption.hotel_name} - {consumption.product_name} '
-                        f'(数量: {consumption.quantity}, 碳排放: {consumption.carbon_emission} kgCO2e)'
+                    created_count += 1
+                    self.stdout.write(
+                        self.style.SUCCESS(
+                            f'创建消耗记录 {i+1}: {consumption.restaurant} - {consumption.product_name} '
+                            f'(数量: {consumption.quantity}, 碳排放: {consumption.carbon_emission} kgCO2e)'
+                        )
                     )
-                )
                 
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f'创建记录 {i+1} 失败: {str(e)}')
-                )
+                except Exception as e:
+                    self.stdout.write(
+                        self.style.ERROR(f'创建记录 {i+1} 失败: {str(e)}')
+                    )
         
         self.stdout.write(
             self.style.SUCCESS(f'\n成功创建 {created_count} 条物料消耗记录！')
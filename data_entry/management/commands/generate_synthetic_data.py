@@ -0,0 +1,54 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from data_entry import synthetic
+
+
+class Command(BaseCommand):
+    help = '批量生成大规模模拟物料消耗记录及对应的每日消费者数据，用于压测和基准测试'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='物料消耗记录条数（默认 1,000,000）')
+        parser.add_argument(
+            '--restaurants', type=int, default=synthetic.DEFAULT_RESTAURANTS, help='餐厅数量'
+        )
+        parser.add_argument(
+            '--start', default=synthetic.DEFAULT_START.isoformat(), help='起始订单日期（YYYY-MM-DD）'
+        )
+        parser.add_argument('--days', type=int, default=synthetic.DEFAULT_DAYS, help='覆盖的天数')
+        parser.add_argument('--prefix', default='模拟餐厅', help='餐厅名称前缀')
+        parser.add_argument('--seed', type=int, default=0, help='随机种子，相同参数生成相同数据')
+        parser.add_argument(
+            '--batch-size', type=int, default=synthetic.DEFAULT_BATCH_SIZE, help='每批生成并写入的记录数'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.strptime(options['start'], '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'起始日期格式错误：{options["start"]}')
+        if options['rows'] <= 0 or options['restaurants'] <= 0 or options['days'] <= 0:
+            raise CommandError('--rows、--restaurants 和 --days 必须大于 0')
+
+        rows = options['rows']
+        started = time.perf_counter()
+
+        def progress(done):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'已写入 {done:,} / {rows:,} 条（{done / elapsed:,.0f} 条/秒）',
+                ending='\n' if done == rows else '\r',
+            )
+            self.stdout.flush()
+
+        consumer_rows = synthetic.seed(
+            rows, seed=options['seed'], batch_size=options['batch_size'],
+            restaurants=options['restaurants'], start=start, days=options['days'],
+            prefix=options['prefix'], progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'完成！生成 {rows:,} 条物料消耗记录、{consumer_rows:,} 条消费者数据，'
+            f'耗时 {time.perf_counter() - started:.1f} 秒。'
+        ))
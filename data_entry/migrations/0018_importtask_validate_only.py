@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_entry", "0017_importtask_error_file"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importtask",
+            name="validate_only",
+            field=models.BooleanField(default=False, verbose_name="仅校验"),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_error_details(apps, schema_editor):
+    """Move the JSON error list of existing tasks into ImportTaskError rows"""
+    ImportTask = apps.get_model("data_entry", "ImportTask")
+    ImportTaskError = apps.get_model("data_entry", "ImportTaskError")
+    for task in ImportTask.objects.exclude(error_details=[]).iterator():
+        errors = [
+            ImportTaskError(task=task, row=item.get("row") or 0, error=item.get("error", ""))
+            for item in task.error_details or []
+        ]
+        ImportTaskError.objects.bulk_create(errors, batch_size=1000)
+        task.error_count = len(errors)
+        task.save(update_fields=["error_count"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_entry", "0018_importtask_validate_only"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importtask",
+            name="error_count",
+            field=models.IntegerField(default=0, verbose_name="失败数"),
+        ),
+        migrations.CreateModel(
+            name="ImportTaskError",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("row", models.IntegerField(verbose_name="行号")),
+                ("error", models.TextField(verbose_name="错误原因")),
+                (
+                    "task",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="errors",
+                        to="data_entry.importtask",
+                        verbose_name="导入任务",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "导入错误",
+                "verbose_name_plural": "导入错误",
+                "ordering": ["task", "row"],
+                "indexes": [
+                    models.Index(
+                        fields=["task", "row"], name="data_entry__task_id_85258f_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(copy_error_details, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="importtask",
+            name="error_details",
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_entry", "0019_importtaskerror"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importtask",
+            name="deleted_count",
+            field=models.IntegerField(default=0, verbose_name="替换删除数"),
+        ),
+        migrations.AddField(
+            model_name="importtask",
+            name="mode",
+            field=models.CharField(
+                choices=[
+                    ("append", "追加（跳过重复记录）"),
+                    ("replace", "替换（覆盖文件中餐厅与日期范围内的记录）"),
+                ],
+                default="append",
+                max_length=20,
+                verbose_name="导入模式",
+            ),
+        ),
+    ]
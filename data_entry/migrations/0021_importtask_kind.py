@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_entry", "0020_importtask_mode"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importtask",
+            name="kind",
+            field=models.CharField(
+                choices=[("material", "物料消耗记录"), ("consumer", "消费者数据")],
+                default="material",
+                max_length=20,
+                verbose_name="导入类型",
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_entry", "0021_importtask_kind"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importtask",
+            name="file_hash",
+            field=models.CharField(
+                blank=True, db_index=True, max_length=64, verbose_name="文件哈希"
+            ),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:25
+
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+
+def populate_monthly_stats(apps, schema_editor):
+    """Build the monthly totals from the existing consumer data"""
+    ConsumerData = apps.get_model("data_entry", "ConsumerData")
+    MonthlyRestaurantStats = apps.get_model("data_entry", "MonthlyRestaurantStats")
+    rows = (
+        ConsumerData.objects.exclude(order_date=None)
+        .annotate(month=TruncMonth("order_date"))
+        .order_by()
+        .values("restaurant", "month")
+        .annotate(total_emission=Sum("daily_carbon_emission"), total_consumers=Sum("consumer_count"))
+    )
+    MonthlyRestaurantStats.objects.bulk_create(
+        [
+            MonthlyRestaurantStats(
+                restaurant=row["restaurant"],
+                month=row["month"],
+                total_emission=row["total_emission"] or 0,
+                total_consumers=row["total_consumers"] or 0,
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("data_entry", "0023_alter_importtask_kind"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyRestaurantStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("restaurant", models.CharField(max_length=50, verbose_name="餐厅")),
+                (
+                    "month",
+                    models.DateField(help_text="当月第一天", verbose_name="月份"),
+                ),
+                (
+                    "total_emission",
+                    models.DecimalField(
+                        decimal_places=6,
+                        default=0,
+                        max_digits=16,
+                        verbose_name="当月碳排总量(kgCO2e)",
+                    ),
+                ),
+                (
+                    "total_consumers",
+                    models.IntegerField(default=0, verbose_name="当月消费者人数"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新时间"),
+                ),
+            ],
+            options={
+                "verbose_name": "餐厅月度统计",
+                "verbose_name_plural": "餐厅月度统计",
+                "ordering": ["-month", "restaurant"],
+                "unique_together": {("restaurant", "month")},
+            },
+        ),
+        migrations.RunPython(populate_monthly_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:07
+
+from django.db import migrations, models
+
+
+def move_refresh_scope_hashes(apps, schema_editor):
+    """Refresh tasks used to keep their scope hash in file_hash"""
+    ImportTask = apps.get_model("data_entry", "ImportTask")
+    refresh_tasks = ImportTask.objects.filter(kind="refresh").exclude(file_hash="")
+    refresh_tasks.update(scope_hash=models.F("file_hash"), file_hash="")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("data_entry", "0024_monthlyrestaurantstats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importtask",
+            name="scope_hash",
+            field=models.CharField(
+                blank=True, db_index=True, max_length=64, verbose_name="范围哈希"
+            ),
+        ),
+        migrations.RunPython(move_refresh_scope_hashes, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,18 @@
 import uuid
-from django.db import models
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection, models
+from django.db.models import F, Sum
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from coefficients.models import EmissionCoefficient, EmissionCategory
+from . import consumer_refresh
 
 # Create your models here.
 
+# carbon_emission columns keep 6 decimal places
+EMISSION_QUANTUM = Decimal('0.000001')
+
 DEPARTMENT_CHOICES = [
     ('production', _('生产部')),
     ('rd', _('研发部')),
@@ -78,32 +86,93 @@ class MaterialConsumption(models.Model):
             models.Index(fields=['category_level1', 'category_level2']),
         ]
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_consumer_contribution()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._remember_consumer_contribution()
+
+    def _remember_consumer_contribution(self):
+        """Remember the stored (restaurant, order_date, carbon_emission) for delta updates"""
+        if 'carbon_emission' in self.__dict__ and 'restaurant' in self.__dict__ and 'order_date' in self.__dict__:
+            self._consumer_contribution = (self.restaurant, self.order_date, self.carbon_emission)
+        else:
+            self._consumer_contribution = None
+
     def save(self, *args, **kwargs):
-        # Auto-calculate carbon emission
-        self.carbon_emission = self.quantity * self.emission_coefficient
+        # Auto-calculate carbon emission, rounded as the column stores it
+        self.carbon_emission = (self.quantity * self.emission_coefficient).quantize(EMISSION_QUANTUM)
+        adding = self._state.adding
+        original = getattr(self, '_consumer_contribution', None)
         super().save(*args, **kwargs)
         
-        # Update related ConsumerData records
-        self.update_consumer_data()
+        # Inside a transaction (or defer_consumer_refresh) the touched days are
+        # recomputed once on commit; otherwise apply this row's emission change
+        if consumer_refresh.collecting():
+            keys = [(self.restaurant, self.order_date)]
+            if original is not None:
+                keys.append(original[:2])
+            consumer_refresh.mark_dirty(keys)
+        elif adding:
+            self._apply_consumer_delta(self.restaurant, self.order_date, self.carbon_emission)
+        elif original is None:
+            # Stored values unknown (instance not loaded from the database)
+            self.update_consumer_data()
+        else:
+            old_restaurant, old_date, old_emission = original
+            if (old_restaurant, old_date) == (self.restaurant, self.order_date):
+                self._apply_consumer_delta(self.restaurant, self.order_date, self.carbon_emission - old_emission)
+            else:
+                self._apply_consumer_delta(old_restaurant, old_date, -old_emission)
+                self._apply_consumer_delta(self.restaurant, self.order_date, self.carbon_emission)
+        self._remember_consumer_contribution()
     
     def delete(self, *args, **kwargs):
         # Store info before deletion
         restaurant = self.restaurant
         order_date = self.order_date
+        original = getattr(self, '_consumer_contribution', None)
         
-        super().delete(*args, **kwargs)
+        result = super().delete(*args, **kwargs)
         
-        # Update related ConsumerData records after deletion
-        consumer_data = ConsumerData.objects.filter(
-            restaurant=restaurant,
-            order_date=order_date
+        # Subtract the stored emission of the deleted row
+        if consumer_refresh.collecting():
+            keys = [(restaurant, order_date)]
+            if original is not None:
+                keys.append(original[:2])
+            consumer_refresh.mark_dirty(keys)
+        elif original is None:
+            ConsumerData.refresh_daily_emissions([(restaurant, order_date)])
+        else:
+            old_restaurant, old_date, old_emission = original
+            self._apply_consumer_delta(old_restaurant, old_date, -old_emission)
+        self._consumer_contribution = None
+        return result
+    
+    @staticmethod
+    def _apply_consumer_delta(restaurant, order_date, delta):
+        """Add delta to daily_carbon_emission of the matching ConsumerData with one UPDATE"""
+        if not delta or order_date is None:
+            return
+        updated = ConsumerData.objects.filter(restaurant=restaurant, order_date=order_date).update(
+            daily_carbon_emission=F('daily_carbon_emission') + delta,
+            updated_at=timezone.now(),
         )
-        for cd in consumer_data:
-            cd.daily_carbon_emission = cd.calculate_daily_emission()
-            cd.save(update_fields=['daily_carbon_emission', 'updated_at'])
+        if updated and not MonthlyRestaurantStats.objects.filter(
+            restaurant=restaurant, month=order_date.replace(day=1)
+        ).update(total_emission=F('total_emission') + delta, updated_at=timezone.now()):
+            MonthlyRestaurantStats.refresh_months([(restaurant, order_date)])
     
     def update_consumer_data(self):
-        """Update daily carbon emission for related ConsumerData records"""
+        """Recompute daily carbon emission of the related ConsumerData from scratch
+
+        save/delete keep the total up to date incrementally; this full recompute
+        is the repair path (see also ConsumerData.refresh_daily_emissions).
+        """
         try:
             consumer_data = ConsumerData.objects.filter(
                 restaurant=self.restaurant,
@@ -167,17 +236,200 @@ class ConsumerData(models.Model):
         ).aggregate(total=Sum('carbon_emission'))['total']
         return total or 0
     
+    @classmethod
+    def refresh_daily_emissions(cls, keys):
+        """Recompute daily_carbon_emission for the given (restaurant, order_date) keys.
+
+        Uses one grouped aggregate over MaterialConsumption and a bulk update,
+        for callers such as the importers that write through bulk_create and
+        therefore bypass MaterialConsumption.save. Returns the number of rows changed.
+        """
+        keys = {(restaurant, order_date) for restaurant, order_date in keys if order_date}
+        if not keys:
+            return 0
+        restaurants = {restaurant for restaurant, _ in keys}
+        date_range = (min(d for _, d in keys), max(d for _, d in keys))
+
+        totals = {
+            (item['restaurant'], item['order_date']): item['total']
+            for item in MaterialConsumption.objects.filter(
+                restaurant__in=restaurants,
+                order_date__range=date_range,
+            ).values('restaurant', 'order_date').annotate(total=Sum('carbon_emission'))
+        }
+
+        now = timezone.now()
+        changed = []
+        for consumer in cls.objects.filter(restaurant__in=restaurants, order_date__range=date_range):
+            key = (consumer.restaurant, consumer.order_date)
+            if key not in keys:
+                continue
+            total = totals.get(key) or 0
+            if consumer.daily_carbon_emission != total:
+                consumer.daily_carbon_emission = total
+                consumer.updated_at = now
+                changed.append(consumer)
+
+        cls.objects.bulk_update(changed, ['daily_carbon_emission', 'updated_at'], batch_size=1000)
+        MonthlyRestaurantStats.refresh_months((consumer.restaurant, consumer.order_date) for consumer in changed)
+        return len(changed)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_key = (instance.__dict__.get('restaurant'), instance.__dict__.get('order_date'))
+        return instance
+
     def save(self, *args, **kwargs):
         # Auto-calculate daily carbon emission
         self.daily_carbon_emission = self.calculate_daily_emission()
         super().save(*args, **kwargs)
+        
+        # Keep the monthly totals of the old and new month in step
+        keys = [(self.restaurant, self.order_date)]
+        stored_key = getattr(self, '_stored_key', None)
+        if stored_key and stored_key != keys[0]:
+            keys.append(stored_key)
+        MonthlyRestaurantStats.refresh_months(keys)
+        self._stored_key = keys[0]
+    
+    def delete(self, *args, **kwargs):
+        keys = [(self.restaurant, self.order_date)]
+        stored_key = getattr(self, '_stored_key', None)
+        if stored_key:
+            keys.append(stored_key)
+        result = super().delete(*args, **kwargs)
+        MonthlyRestaurantStats.refresh_months(keys)
+        return result
     
     def __str__(self):
         return f"{self.restaurant} ({self.order_date})"
 
 
+class MonthlyRestaurantStats(models.Model):
+    """Monthly totals of ConsumerData per restaurant, kept up to date on every write
+
+    Backs the monthly per-capita figure used for the adjusted daily emission, so
+    readers join one row per (restaurant, month) instead of aggregating the month.
+    """
+    restaurant = models.CharField(_('餐厅'), max_length=50)
+    month = models.DateField(_('月份'), help_text=_('当月第一天'))
+    total_emission = models.DecimalField(_('当月碳排总量(kgCO2e)'), max_digits=16, decimal_places=6, default=0)
+    total_consumers = models.IntegerField(_('当月消费者人数'), default=0)
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('餐厅月度统计')
+        verbose_name_plural = _('餐厅月度统计')
+        ordering = ['-month', 'restaurant']
+        unique_together = [['restaurant', 'month']]
+
+    def __str__(self):
+        return f"{self.restaurant} ({self.month:%Y-%m})"
+
+    @classmethod
+    def refresh_months(cls, keys):
+        """Recompute the months touched by the given (restaurant, date) keys from ConsumerData
+
+        One grouped aggregate over the affected restaurants and months; rows are
+        then created, updated or removed in bulk.
+        """
+        from django.db.models.functions import TruncMonth
+
+        to_date = ConsumerData._meta.get_field('order_date').to_python
+        months = {
+            (restaurant, to_date(day).replace(day=1)) for restaurant, day in keys if restaurant is not None and day
+        }
+        if not months:
+            return
+        restaurants = {restaurant for restaurant, _month in months}
+        first = min(month for _restaurant, month in months)
+        last = max(month for _restaurant, month in months)
+        next_month = (last.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+        totals = {
+            (item['restaurant'], item['month']): (item['total_emission'] or 0, item['total_consumers'] or 0)
+            for item in ConsumerData.objects.filter(
+                restaurant__in=restaurants, order_date__gte=first, order_date__lt=next_month
+            ).annotate(month=TruncMonth('order_date')).order_by().values('restaurant', 'month').annotate(
+                total_emission=Sum('daily_carbon_emission'), total_consumers=Sum('consumer_count')
+            )
+        }
+        existing = {
+            (stats.restaurant, stats.month): stats
+            for stats in cls.objects.filter(restaurant__in=restaurants, month__range=(first, last))
+        }
+
+        now = timezone.now()
+        to_create, to_update, to_delete = [], [], []
+        for key in months:
+            stats = existing.get(key)
+            if key not in totals:
+                if stats is not None:
+                    to_delete.append(stats.pk)
+                continue
+            total_emission, total_consumers = totals[key]
+            if stats is None:
+                to_create.append(cls(
+                    restaurant=key[0], month=key[1],
+                    total_emission=total_emission, total_consumers=total_consumers
+                ))
+            elif (stats.total_emission, stats.total_consumers) != (total_emission, total_consumers):
+                stats.total_emission = total_emission
+                stats.total_consumers = total_consumers
+                stats.updated_at = now
+                to_update.append(stats)
+
+        if connection.features.supports_update_conflicts_with_target:
+            # A concurrent writer may have created the row since it was read; update it instead
+            cls.objects.bulk_create(
+                to_create, batch_size=1000, update_conflicts=True, unique_fields=['restaurant', 'month'],
+                update_fields=['total_emission', 'total_consumers', 'updated_at'],
+            )
+        else:
+            cls.objects.bulk_create(to_create, batch_size=1000, ignore_conflicts=True)
+        cls.objects.bulk_update(to_update, ['total_emission', 'total_consumers', 'updated_at'], batch_size=1000)
+        if to_delete:
+            cls.objects.filter(pk__in=to_delete).delete()
+
+    @classmethod
+    def annotate_consumers(cls, queryset):
+        """Annotate ConsumerData rows with the totals of their month and the adjusted emission
+
+        Adds month_total_emission, month_total_consumers and
+        adjusted_daily_carbon_emission = (当月总碳排 / 当月总人数) × 当日消费者人数
+        (0 when the month has no consumers), all usable for filtering and ordering.
+        """
+        from django.db.models import Case, ExpressionWrapper, OuterRef, Subquery, Value, When
+        from django.db.models.functions import Cast, TruncMonth
+
+        queryset = queryset.annotate(order_month=TruncMonth('order_date'))
+        stats = cls.objects.filter(restaurant=OuterRef('restaurant'), month=OuterRef('order_month'))
+        return queryset.annotate(
+            month_total_emission=Subquery(stats.values('total_emission')[:1]),
+            month_total_consumers=Subquery(stats.values('total_consumers')[:1]),
+        ).annotate(
+            adjusted_daily_carbon_emission=Case(
+                When(order_date__isnull=True, then=Value(None)),
+                When(
+                    month_total_consumers__gt=0,
+                    # SQLite stores whole NUMERIC values as integers, so divide by a float
+                    # to avoid integer division
+                    then=ExpressionWrapper(
+                        F('month_total_emission') * F('consumer_count')
+                        / Cast('month_total_consumers', models.FloatField()),
+                        output_field=models.DecimalField(max_digits=16, decimal_places=6),
+                    ),
+                ),
+                default=Value(Decimal('0')),
+                output_field=models.DecimalField(max_digits=16, decimal_places=6),
+            ),
+        )
+
+
 class ImportTask(models.Model):
-    """Tracks the status and progress of an async data import job"""
+    """Tracks the status and progress of a background job: material/consumer data imports
+    and the consumer emission refresh"""
 
     STATUS_PENDING = 'pending'
     STATUS_PROCESSING = 'processing'
@@ -190,14 +442,37 @@ class ImportTask(models.Model):
         (STATUS_FAILED, _('失败')),
     ]
 
+    KIND_MATERIAL = 'material'
+    KIND_CONSUMER = 'consumer'
+    KIND_REFRESH = 'refresh'
+    KIND_CHOICES = [
+        (KIND_MATERIAL, _('物料消耗记录')),
+        (KIND_CONSUMER, _('消费者数据')),
+        (KIND_REFRESH, _('刷新碳排放')),
+    ]
+
+    MODE_APPEND = 'append'
+    MODE_REPLACE = 'replace'
+    MODE_CHOICES = [
+        (MODE_APPEND, _('追加（跳过重复记录）')),
+        (MODE_REPLACE, _('替换（覆盖文件中餐厅与日期范围内的记录）')),
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(_('导入类型'), max_length=20, choices=KIND_CHOICES, default=KIND_MATERIAL)
+    file_hash = models.CharField(_('文件哈希'), max_length=64, blank=True, db_index=True)
+    # Refresh tasks: hash of the filters they recompute, to reuse a running one
+    scope_hash = models.CharField(_('范围哈希'), max_length=64, blank=True, db_index=True)
     status = models.CharField(_('状态'), max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
     total_rows = models.IntegerField(_('总行数'), default=0)
     processed_rows = models.IntegerField(_('已处理行数'), default=0)
     success_count = models.IntegerField(_('成功数'), default=0)
-    error_details = models.JSONField(_('错误详情'), default=list)
+    error_count = models.IntegerField(_('失败数'), default=0)
     error_message = models.TextField(_('错误信息'), blank=True)
     error_file = models.CharField(_('错误文件路径'), max_length=500, blank=True)
+    validate_only = models.BooleanField(_('仅校验'), default=False)
+    mode = models.CharField(_('导入模式'), max_length=20, choices=MODE_CHOICES, default=MODE_APPEND)
+    deleted_count = models.IntegerField(_('替换删除数'), default=0)
     created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
     updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
 
@@ -208,3 +483,27 @@ class ImportTask(models.Model):
 
     def __str__(self):
         return f"ImportTask {self.id} [{self.status}]"
+
+
+class ImportTaskError(models.Model):
+    """A failed row of an ImportTask, stored one per row so reports can be paged"""
+
+    task = models.ForeignKey(
+        ImportTask,
+        on_delete=models.CASCADE,
+        verbose_name=_('导入任务'),
+        related_name='errors'
+    )
+    row = models.IntegerField(_('行号'))
+    error = models.TextField(_('错误原因'))
+
+    class Meta:
+        verbose_name = _('导入错误')
+        verbose_name_plural = _('导入错误')
+        ordering = ['task', 'row']
+        indexes = [
+            models.Index(fields=['task', 'row']),
+        ]
+
+    def __str__(self):
+        return f"ImportTask {self.task_id} row {self.row}"
@@ -0,0 +1,296 @@
+"""
+Synthetic MaterialConsumption / ConsumerData rows for benchmarks and load tests.
+
+Rows are generated in vectorized numpy batches from a seeded Generator, so the
+same arguments always produce the same data set:
+
+- products (several per coefficient) and restaurants follow skewed popularity,
+  so a few products and restaurants account for most rows;
+- order dates lean towards weekends, consumption times cluster around
+  breakfast, lunch and dinner;
+- carbon emission is quantity × coefficient rounded like MaterialConsumption.save,
+  computed in integer micro-units, and ConsumerData.daily_carbon_emission is the
+  exact sum of each restaurant's day.
+
+Material rows are written with raw batched INSERTs (no model instances), which
+keeps multi-million-row data sets within minutes. Dates fall in 2024 by default,
+which covers the default ranges of the dashboard and data customization pages.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.db import connection, transaction
+from django.utils import timezone
+
+from coefficients.models import EmissionCategory, EmissionCoefficient
+from . import consumer_refresh
+from .models import ConsumerData, MaterialConsumption, MonthlyRestaurantStats
+
+DEFAULT_START = date(2024, 1, 1)
+DEFAULT_DAYS = 366
+DEFAULT_RESTAURANTS = 20
+DEFAULT_BATCH_SIZE = 50000
+
+# (level 1, level 2, unit, kgCO2e per unit) created when the database has no coefficients
+SAMPLE_COEFFICIENTS = [
+    ('Meat', 'Bovine meat', 'KG', 42.80),
+    ('Meat', 'Pig meat', 'KG', 7.28),
+    ('Meat', 'Poultry meat', 'KG', 6.10),
+    ('Seafood', 'Molluscs, other', 'KG', 7.30),
+    ('Seafood', 'Fish, farmed', 'KG', 5.10),
+    ('Dairy', 'Milk', 'L', 1.39),
+    ('Dairy', 'Cheese', 'KG', 23.90),
+    ('Vegetables', 'Tomatoes', 'KG', 2.09),
+    ('Vegetables', 'Root vegetables', 'KG', 0.43),
+    ('Grains', 'Rice', 'KG', 4.45),
+    ('Grains', 'Wheat & Rye (Bread)', 'KG', 1.57),
+    ('Beverages', 'Coffee', 'KG', 28.53),
+]
+
+# Meal peaks of consumption_time: (share, mean hour, standard deviation in hours)
+MEAL_PEAKS = [(0.2, 8.0, 0.6), (0.45, 12.25, 0.8), (0.35, 18.75, 1.0)]
+PRODUCT_VARIANTS = 4  # products generated per coefficient
+PRODUCT_SKEW = 1.1  # Zipf exponent of product popularity
+RESTAURANT_SKEW = 0.8  # sigma of the lognormal restaurant sizes
+WEEKEND_FACTOR = 1.4  # weekend days get this many times the rows of a weekday
+
+
+def ensure_coefficients():
+    """Return [(level1 id, level2 id, level1 name, level2 name, unit, coefficient)], creating samples if needed"""
+    if not EmissionCoefficient.objects.exists():
+        for level1_name, level2_name, unit, value in SAMPLE_COEFFICIENTS:
+            level1, _ = EmissionCategory.objects.get_or_create(name=level1_name, level=1, defaults={'parent': None})
+            level2, _ = EmissionCategory.objects.get_or_create(name=level2_name, level=2, parent=level1)
+            EmissionCoefficient.objects.create(
+                category_level1=level1, category_level2=level2, unit=unit, coefficient=value
+            )
+    return [
+        (c.category_level1_id, c.category_level2_id, c.category_level1.name, c.category_level2.name,
+         c.unit, c.coefficient)
+        for c in EmissionCoefficient.objects.select_related('category_level1', 'category_level2').order_by('pk')
+    ]
+
+
+def restaurant_names(count, prefix='餐厅'):
+    return [f'{prefix}{i + 1:03d}' for i in range(count)]
+
+
+class Generator:
+    """
+    Draws consumption rows for a fixed catalogue of products, restaurants and days.
+
+    All per-row work is numpy indexing into the catalogue arrays; batch() returns
+    a dict of column arrays keyed by MaterialConsumption attribute names.
+    """
+
+    def __init__(self, coefficients, restaurants, start=DEFAULT_START, days=DEFAULT_DAYS, seed=0):
+        self.rng = np.random.default_rng(seed)
+        rng = self.rng
+
+        # Product catalogue: PRODUCT_VARIANTS products per coefficient, Zipf popularity in random order
+        coefficient_index = np.repeat(np.arange(len(coefficients)), PRODUCT_VARIANTS)
+        variant = np.tile(np.arange(1, PRODUCT_VARIANTS + 1), len(coefficients))
+        level1_ids, level2_ids, _level1_names, level2_names, units, values = zip(*coefficients)
+        self.level1_id = np.array(level1_ids, dtype=np.int64)[coefficient_index]
+        self.level2_id = np.array(level2_ids, dtype=np.int64)[coefficient_index]
+        self.product_code = np.array(
+            [f'P{index + 1:03d}{number:02d}' for index, number in zip(coefficient_index, variant)], dtype=object
+        )
+        self.product_name = np.array(
+            [f'{level2_names[index]} #{number}' for index, number in zip(coefficient_index, variant)], dtype=object
+        )
+        self.unit = np.array(units, dtype=object)[coefficient_index]
+        # Coefficients and quantities are handled as integers (micro / milli units) so
+        # emissions round exactly like the Decimal arithmetic in MaterialConsumption.save
+        self.coefficient_micro = np.array(
+            [int(value * 1000000) for value in values], dtype=np.int64
+        )[coefficient_index]
+        self.coefficient = np.array([str(value) for value in values], dtype=object)[coefficient_index]
+        popularity = 1.0 / np.arange(1, len(coefficient_index) + 1) ** PRODUCT_SKEW
+        self.product_weights = rng.permutation(popularity / popularity.sum())
+        self.typical_quantity = rng.uniform(0.5, 8.0, len(coefficient_index))
+
+        sizes = rng.lognormal(0.0, RESTAURANT_SKEW, len(restaurants))
+        self.restaurants = np.array(restaurants, dtype=object)
+        self.restaurant_weights = sizes / sizes.sum()
+
+        self.days = np.array([start + timedelta(days=offset) for offset in range(days)], dtype=object)
+        day_weights = np.where([day.weekday() >= 5 for day in self.days], WEEKEND_FACTOR, 1.0)
+        self.day_weights = day_weights / day_weights.sum()
+        self.day_text = np.array([day.isoformat() for day in self.days], dtype=object)
+        seconds = np.arange(86400)
+        self.time_text = np.array(
+            [f'{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}' for s in seconds], dtype=object
+        )
+
+    def batch(self, size):
+        rng = self.rng
+        product = rng.choice(len(self.product_weights), size, p=self.product_weights)
+        restaurant = rng.choice(len(self.restaurants), size, p=self.restaurant_weights)
+        day = rng.choice(len(self.days), size, p=self.day_weights)
+
+        shares, means, deviations = (np.array(column) for column in zip(*MEAL_PEAKS))
+        meal = rng.choice(len(MEAL_PEAKS), size, p=shares / shares.sum())
+        hours = np.clip(rng.normal(means[meal], deviations[meal]), 6.0, 23.0)
+        seconds = (hours * 3600).astype(np.int64)
+
+        quantity_milli = np.maximum(
+            np.rint(rng.lognormal(np.log(self.typical_quantity[product]), 0.6) * 1000), 1
+        ).astype(np.int64)
+        # quantity (1e-3) × coefficient (1e-6) is in 1e-9 units; round half to even to 1e-6
+        nano = quantity_milli * self.coefficient_micro[product]
+        micro, remainder = np.divmod(nano, 1000)
+        micro += (remainder > 500) | ((remainder == 500) & (micro % 2 == 1))
+
+        return {
+            'restaurant': self.restaurants[restaurant],
+            'category_level1_id': self.level1_id[product],
+            'category_level2_id': self.level2_id[product],
+            'product_code': self.product_code[product],
+            'product_name': self.product_name[product],
+            'product_unit': self.unit[product],
+            'emission_coefficient': self.coefficient[product],
+            'order_date': self.day_text[day],
+            'consumption_time': self.time_text[seconds],
+            'quantity': quantity_milli,
+            'carbon_emission_micro': micro,
+            'restaurant_index': restaurant,
+            'day_index': day,
+        }
+
+
+def _insert_rows(cursor, table, columns, rows):
+    """INSERT rows (tuples) with as few round trips as the backend allows"""
+    quoted = ', '.join(connection.ops.quote_name(column) for column in columns)
+    row_sql = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    if connection.vendor == 'sqlite':
+        # executemany stays in-process for SQLite and is its fastest path
+        cursor.executemany(f'INSERT INTO {table} ({quoted}) VALUES {row_sql}', rows)
+        return
+    per_statement = max(min(1000, (connection.features.max_query_params or 65535) // len(columns)), 1)
+    for start in range(0, len(rows), per_statement):
+        chunk = rows[start:start + per_statement]
+        cursor.execute(
+            f'INSERT INTO {table} ({quoted}) VALUES ' + ', '.join([row_sql] * len(chunk)),
+            [value for row in chunk for value in row],
+        )
+
+
+def seed(rows, seed=0, batch_size=DEFAULT_BATCH_SIZE, restaurants=DEFAULT_RESTAURANTS,
+         start=DEFAULT_START, days=DEFAULT_DAYS, prefix='餐厅', progress=None):
+    """
+    Insert rows MaterialConsumption records plus the matching ConsumerData and monthly stats.
+
+    Restaurants are named prefix + number. ConsumerData rows that already exist for
+    a generated restaurant and day keep their consumer count and get their daily
+    total recomputed. progress(done) is called after every batch. Returns the
+    number of ConsumerData rows created.
+    """
+    generator = Generator(ensure_coefficients(), restaurant_names(restaurants, prefix), start, days, seed)
+    table = connection.ops.quote_name(MaterialConsumption._meta.db_table)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    columns = [
+        'restaurant', 'category_level1_id', 'category_level2_id', 'product_code', 'product_name',
+        'product_unit', 'emission_coefficient', 'order_date', 'consumption_time', 'quantity',
+        'carbon_emission', 'special_note', 'created_at', 'updated_at',
+    ]
+    # Exact per-(restaurant, day) emission totals in micro-units
+    daily_micro = np.zeros((restaurants, days), dtype=np.int64)
+
+    for offset in range(0, rows, batch_size):
+        size = min(batch_size, rows - offset)
+        batch = generator.batch(size)
+        np.add.at(daily_micro, (batch['restaurant_index'], batch['day_index']), batch['carbon_emission_micro'])
+        values = [
+            batch['restaurant'].tolist(),
+            batch['category_level1_id'].tolist(),
+            batch['category_level2_id'].tolist(),
+            batch['product_code'].tolist(),
+            batch['product_name'].tolist(),
+            batch['product_unit'].tolist(),
+            batch['emission_coefficient'].tolist(),
+            batch['order_date'].tolist(),
+            batch['consumption_time'].tolist(),
+            (batch['quantity'] / 1000).tolist(),
+            (batch['carbon_emission_micro'] / 1000000).tolist(),
+            [''] * size,
+            [now] * size,
+            [now] * size,
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            _insert_rows(cursor, table, columns, list(zip(*values)))
+        if progress:
+            progress(offset + size)
+
+    return _write_consumer_data(generator, daily_micro)
+
+
+def _write_consumer_data(generator, daily_micro):
+    """Create ConsumerData for every generated restaurant and day, sized like the restaurant"""
+    rng = generator.rng
+    restaurant_positions, day_positions = np.nonzero(daily_micro)
+    if not len(restaurant_positions):
+        return 0
+    # Busy restaurants and weekends serve more people
+    base = 30 + 370 * generator.restaurant_weights / generator.restaurant_weights.max()
+    weekend = np.array([day.weekday() >= 5 for day in generator.days])
+    counts = np.rint(
+        base[restaurant_positions] * np.where(weekend[day_positions], WEEKEND_FACTOR, 1.0)
+        * rng.uniform(0.8, 1.2, len(restaurant_positions))
+    ).astype(int)
+
+    restaurants = generator.restaurants[restaurant_positions]
+    days = generator.days[day_positions]
+    existing = set(ConsumerData.objects.filter(
+        restaurant__in=set(restaurants), order_date__range=(generator.days[0], generator.days[-1])
+    ).values_list('restaurant', 'order_date'))
+
+    consumers = [
+        ConsumerData(
+            restaurant=restaurant, order_date=day, consumer_count=int(count),
+            daily_carbon_emission=Decimal(int(total)).scaleb(-6),
+        )
+        for restaurant, day, count, total in zip(
+            restaurants, days, counts, daily_micro[restaurant_positions, day_positions]
+        )
+        if (restaurant, day) not in existing
+    ]
+    with transaction.atomic():
+        ConsumerData.objects.bulk_create(consumers, batch_size=5000)
+        MonthlyRestaurantStats.refresh_months((c.restaurant, c.order_date) for c in consumers)
+    # Days that already had ConsumerData now include the new material rows
+    consumer_refresh.mark_dirty(existing)
+    return len(consumers)
+
+
+def material_import_frame(rows, seed=0, restaurants=5, start=DEFAULT_START, days=DEFAULT_DAYS):
+    """A DataFrame laid out like the material import template (Chinese headers)"""
+    coefficients = ensure_coefficients()
+    generator = Generator(coefficients, restaurant_names(restaurants, '导入餐厅'), start, days, seed)
+    batch = generator.batch(rows)
+    level1_names = {level1_id: name for level1_id, _l2, name, _n2, _u, _v in coefficients}
+    level2_names = {level2_id: name for _l1, level2_id, _n1, name, _u, _v in coefficients}
+    return pd.DataFrame({
+        '餐厅': batch['restaurant'],
+        '产品编码': batch['product_code'],
+        '一级分类': [level1_names[pk] for pk in batch['category_level1_id']],
+        '二级分类': [level2_names[pk] for pk in batch['category_level2_id']],
+        '产品名称': batch['product_name'],
+        '订单日期': batch['order_date'],
+        '消耗时间': batch['consumption_time'],
+        '消耗数量': batch['quantity'] / 1000,
+    })
+
+
+def consumer_import_frame(restaurants=5, start=DEFAULT_START, days=DEFAULT_DAYS, seed=0):
+    """A DataFrame laid out like the consumer import template: one row per restaurant and day"""
+    rng = np.random.default_rng(seed)
+    names = restaurant_names(restaurants, '导入餐厅')
+    dates = [(start + timedelta(days=offset)).isoformat() for offset in range(days)]
+    return pd.DataFrame({
+        '餐厅': np.repeat(names, len(dates)),
+        '订单日期': np.tile(dates, len(names)),
+        '消费者人数': rng.integers(20, 400, len(names) * len(dates)),
+    })
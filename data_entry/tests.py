@@ -1,3 +1,297 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from coefficients.models import EmissionCategory, EmissionCoefficient, UnitConversion
+from . import consumer_refresh
+from .models import ConsumerData, ImportTask, MaterialConsumption, MonthlyRestaurantStats
+from .views import _existing_import_keys, _find_duplicate_import, process_import_data
+
+
+class ImportFixtureMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_catalog()
+
+    @classmethod
+    def create_catalog(cls):
+        cls.meat = EmissionCategory.objects.create(name='Meat', level=1)
+        cls.beef = EmissionCategory.objects.create(name='Beef', level=2, parent=cls.meat)
+        EmissionCoefficient.objects.create(
+            category_level1=cls.meat, category_level2=cls.beef, unit='KG', coefficient=Decimal('2.5')
+        )
+
+    def row(self, restaurant, order_date, quantity=1, name='beef', level2='Beef'):
+        return {
+            '餐厅': restaurant, '产品编码': 'P1', '一级分类': 'Meat', '二级分类': level2,
+            '产品名称': name, '订单日期': order_date, '消耗数量': quantity,
+        }
+
+    def import_rows(self, rows, **kwargs):
+        return process_import_data(pd.DataFrame(rows), **kwargs)
+
+    def consumption(self, restaurant, order_date, quantity, name='beef'):
+        return MaterialConsumption.objects.create(
+            restaurant=restaurant, product_code='P1', product_name=name,
+            category_level1=self.meat, category_level2=self.beef, product_unit='KG',
+            emission_coefficient=Decimal('2.5'), order_date=order_date, quantity=Decimal(quantity),
+        )
+
+
+@override_settings(IMPORT_PARALLEL_WORKERS=1)
+class ValidateOnlyImportTests(ImportFixtureMixin, TestCase):
+    def test_reports_duplicates_of_stored_records_without_writing(self):
+        self.import_rows([self.row('R1', '2024-01-01', 2)])
+        result = self.import_rows(
+            [self.row('R1', '2024-01-01', 2), self.row('R1', '2024-01-02', 2), self.row('R1', '2024-01-02', 2)],
+            validate_only=True,
+        )
+        self.assertEqual(result['success_count'], 1)
+        self.assertEqual([error['row'] for error in result['errors']], [2, 4])
+        self.assertEqual(MaterialConsumption.objects.count(), 1)
+
+    def test_existing_keys_cover_only_the_file_restaurants_and_dates(self):
+        self.consumption('R1', date(2024, 1, 1), 1)
+        self.consumption('R1', date(2024, 1, 3), 1)
+        self.consumption('R1', date(2023, 12, 31), 1)
+        self.consumption('Other', date(2024, 1, 2), 1)
+        df = pd.DataFrame([self.row('R1', '2024-01-01'), self.row(' R1 ', '03/01/2024')]).rename(
+            columns={'餐厅': 'restaurant', '订单日期': 'order_date'}
+        )
+        keys = _existing_import_keys(df)
+        self.assertEqual(sorted(key[4] for key in keys), [date(2024, 1, 1), date(2024, 1, 3)])
+
+
+@override_settings(IMPORT_PARALLEL_WORKERS=1)
+class ReplaceImportTests(ImportFixtureMixin, TestCase):
+    def setUp(self):
+        for restaurant in ('R1', 'R2'):
+            self.consumption(restaurant, date(2024, 1, 1), 2)
+            ConsumerData.objects.create(restaurant=restaurant, order_date=date(2024, 1, 1), consumer_count=10)
+
+    def replace(self, rows):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.import_rows(rows, mode=ImportTask.MODE_REPLACE)
+
+    def stored(self):
+        return sorted(MaterialConsumption.objects.values_list('restaurant', 'quantity'))
+
+    def totals(self):
+        return dict(ConsumerData.objects.values_list('restaurant', 'daily_carbon_emission'))
+
+    def test_file_with_only_failing_rows_deletes_nothing(self):
+        result = self.replace([self.row('R1', '2024-01-01', 4, level2='Unknown')])
+        self.assertEqual(result['deleted_count'], 0)
+        self.assertEqual(self.stored(), [('R1', Decimal('2')), ('R2', Decimal('2'))])
+        self.assertEqual(self.totals(), {'R1': Decimal('5'), 'R2': Decimal('5')})
+
+    def test_restaurant_with_failing_rows_keeps_its_records(self):
+        result = self.replace([
+            self.row('R1', '2024-01-01', 4),
+            self.row('R2', '2024-01-01', 6),
+            self.row('R2', '2024-01-01', 1, level2='Unknown'),
+        ])
+        self.assertEqual((result['success_count'], result['deleted_count']), (1, 1))
+        self.assertEqual([error['row'] for error in result['errors']], [3, 4])
+        self.assertEqual(self.stored(), [('R1', Decimal('4')), ('R2', Decimal('2'))])
+        self.assertEqual(self.totals(), {'R1': Decimal('10'), 'R2': Decimal('5')})
+
+
+@override_settings(IMPORT_PARALLEL_WORKERS=1)
+class UnitConversionImportTests(ImportFixtureMixin, TestCase):
+    def setUp(self):
+        UnitConversion.objects.create(product_code='P1', from_unit='箱', to_unit='KG', factor=Decimal('10'))
+        UnitConversion.objects.create(product_code='P2', from_unit='箱', to_unit='KG', factor=Decimal('20'))
+
+    def unit_row(self, product_code, unit, quantity):
+        return {**self.row('R1', '2024-01-01', quantity), '产品编码': product_code, '单位': unit}
+
+    def quantities(self):
+        return dict(MaterialConsumption.objects.values_list('product_code', 'quantity'))
+
+    def test_pack_units_use_the_product_conversion(self):
+        result = self.import_rows(
+            [self.unit_row('P1', '箱', 2), self.unit_row('P2', '箱', 3), self.unit_row('P3', '箱', 2)]
+        )
+        self.assertEqual(self.quantities(), {'P1': Decimal('20'), 'P2': Decimal('60')})
+        self.assertEqual([error['row'] for error in result['errors']], [4])
+
+    def test_product_conversion_overrides_the_generic_one(self):
+        UnitConversion.objects.create(product_code='P1', from_unit='g', to_unit='KG', factor=Decimal('0.002'))
+        self.import_rows([self.unit_row('P1', 'g', 500), self.unit_row('P2', 'G', 600)])
+        self.assertEqual(self.quantities(), {'P1': Decimal('1'), 'P2': Decimal('0.6')})
+
+
+@override_settings(METRICS_ENABLED=False, IMPORT_TASK_STALE_SECONDS=600)
+@mock.patch('data_entry.views.threading.Thread')
+class ConsumerRefreshTaskTests(TestCase):
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'a@example.com', 'x'))
+
+    def refresh(self, query=''):
+        self.client.post(reverse('consumer_refresh_emissions'), {'query': query})
+        return ImportTask.objects.filter(kind=ImportTask.KIND_REFRESH).order_by('-created_at').first()
+
+    def test_running_refresh_with_the_same_scope_is_reused(self, thread):
+        first = self.refresh('R1')
+        self.assertEqual(self.refresh('R1'), first)
+        self.assertEqual(thread.call_count, 1)
+
+    def test_other_scope_starts_its_own_refresh(self, thread):
+        first = self.refresh('R1')
+        second = self.refresh('R2')
+        self.assertNotEqual(first, second)
+        self.assertEqual(first.file_hash, '')
+        self.assertNotEqual(first.scope_hash, second.scope_hash)
+
+    def test_stale_refresh_is_failed_instead_of_reused(self, thread):
+        stale = self.refresh('R1')
+        ImportTask.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        fresh = self.refresh('R1')
+        self.assertNotEqual(fresh, stale)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, ImportTask.STATUS_FAILED)
+
+
+@override_settings(IMPORT_TASK_STALE_SECONDS=600)
+class DuplicateImportTests(TestCase):
+    def task(self, status, age=timedelta(0), **kwargs):
+        task = ImportTask.objects.create(status=status, file_hash='h', **kwargs)
+        ImportTask.objects.filter(pk=task.pk).update(updated_at=timezone.now() - age)
+        return task
+
+    def test_finished_and_running_imports_are_duplicates(self):
+        done = self.task(ImportTask.STATUS_DONE, age=timedelta(days=3))
+        self.assertEqual(_find_duplicate_import(ImportTask.KIND_MATERIAL, 'h'), done)
+        running = self.task(ImportTask.STATUS_PROCESSING)
+        self.assertEqual(_find_duplicate_import(ImportTask.KIND_MATERIAL, 'h'), running)
+
+    def test_failed_dry_run_and_other_kind_imports_are_not(self):
+        self.task(ImportTask.STATUS_FAILED)
+        self.task(ImportTask.STATUS_DONE, validate_only=True)
+        self.task(ImportTask.STATUS_DONE, kind=ImportTask.KIND_CONSUMER)
+        self.assertIsNone(_find_duplicate_import(ImportTask.KIND_MATERIAL, 'h'))
+
+    def test_stalled_import_is_failed_and_not_a_duplicate(self):
+        stalled = self.task(ImportTask.STATUS_PROCESSING, age=timedelta(hours=1))
+        self.assertIsNone(_find_duplicate_import(ImportTask.KIND_MATERIAL, 'h'))
+        stalled.refresh_from_db()
+        self.assertEqual(stalled.status, ImportTask.STATUS_FAILED)
+
+
+# Outside a transaction, save/delete apply the row's emission change to ConsumerData,
+# so these run without TestCase's wrapping atomic block
+class ConsumerDeltaTests(ImportFixtureMixin, TransactionTestCase):
+    def setUp(self):
+        consumer_refresh._pending().clear()
+        self.create_catalog()
+        for day in (1, 2):
+            ConsumerData.objects.create(restaurant='R1', order_date=date(2024, 1, day), consumer_count=10)
+
+    def assertTotals(self, day1, day2):
+        totals = dict(ConsumerData.objects.values_list('order_date', 'daily_carbon_emission'))
+        self.assertEqual(totals, {date(2024, 1, 1): Decimal(day1), date(2024, 1, 2): Decimal(day2)})
+        for consumer in ConsumerData.objects.all():
+            self.assertEqual(consumer.daily_carbon_emission, consumer.calculate_daily_emission())
+        self.assertEqual(
+            MonthlyRestaurantStats.objects.get(restaurant='R1', month=date(2024, 1, 1)).total_emission,
+            Decimal(day1) + Decimal(day2),
+        )
+
+    def test_create_adds_the_emission(self):
+        with mock.patch.object(ConsumerData, 'calculate_daily_emission') as recompute:
+            self.consumption('R1', date(2024, 1, 1), 2)
+        recompute.assert_not_called()
+        self.assertTotals('5', '0')
+
+    def test_update_applies_the_difference(self):
+        self.consumption('R1', date(2024, 1, 1), 2)
+        consumption = MaterialConsumption.objects.get()
+        consumption.quantity = Decimal('3')
+        with mock.patch.object(ConsumerData, 'calculate_daily_emission') as recompute:
+            consumption.save()
+        recompute.assert_not_called()
+        self.assertTotals('7.5', '0')
+
+    def test_moving_a_row_moves_its_emission(self):
+        self.consumption('R1', date(2024, 1, 1), 2)
+        consumption = MaterialConsumption.objects.get()
+        consumption.order_date = date(2024, 1, 2)
+        consumption.quantity = Decimal('4')
+        consumption.save()
+        self.assertTotals('0', '10')
+
+        consumption.restaurant = 'R2'
+        consumption.save()
+        self.assertTotals('0', '0')
+
+    def test_delete_subtracts_the_stored_emission(self):
+        self.consumption('R1', date(2024, 1, 1), 2)
+        self.consumption('R1', date(2024, 1, 1), 1)
+        consumption = MaterialConsumption.objects.filter(quantity=2).get()
+        # Unsaved edits do not change what is subtracted
+        consumption.quantity = Decimal('100')
+        consumption.delete()
+        self.assertTotals('2.5', '0')
+
+    def test_instance_not_loaded_from_the_database_is_recomputed(self):
+        stored = self.consumption('R1', date(2024, 1, 1), 2)
+        consumption = MaterialConsumption(**{
+            field.attname: getattr(stored, field.attname) for field in MaterialConsumption._meta.concrete_fields
+        })
+        consumption._state.adding = False
+        consumption.quantity = Decimal('4')
+        consumption.save()
+        self.assertTotals('10', '0')
+
+
+class ConsumerRefreshCoalescingTests(ImportFixtureMixin, TransactionTestCase):
+    def setUp(self):
+        consumer_refresh._pending().clear()
+        self.create_catalog()
+        for day in (1, 2):
+            ConsumerData.objects.create(restaurant='R1', order_date=date(2024, 1, day), consumer_count=10)
+        patcher = mock.patch.object(
+            ConsumerData, 'refresh_daily_emissions', wraps=ConsumerData.refresh_daily_emissions
+        )
+        self.refresh = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def totals(self):
+        return dict(ConsumerData.objects.values_list('order_date', 'daily_carbon_emission'))
+
+    def test_writes_in_a_transaction_are_recomputed_once_on_commit(self):
+        with transaction.atomic():
+            for day in (1, 1, 2):
+                self.consumption('R1', date(2024, 1, day), 2)
+            self.assertEqual(self.totals()[date(2024, 1, 1)], 0)
+            self.refresh.assert_not_called()
+        self.refresh.assert_called_once_with({('R1', date(2024, 1, 1)), ('R1', date(2024, 1, 2))})
+        self.assertEqual(self.totals(), {date(2024, 1, 1): Decimal('10'), date(2024, 1, 2): Decimal('5')})
+
+    def test_defer_block_recomputes_once_on_exit(self):
+        with consumer_refresh.defer_consumer_refresh():
+            self.consumption('R1', date(2024, 1, 1), 2)
+            MaterialConsumption.objects.get().delete()
+            self.consumption('R1', date(2024, 1, 2), 2)
+        self.refresh.assert_called_once()
+        self.assertEqual(self.totals(), {date(2024, 1, 1): Decimal('0'), date(2024, 1, 2): Decimal('5')})
+
+    def test_rolled_back_keys_are_recomputed_by_the_next_flush(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.consumption('R1', date(2024, 1, 1), 2)
+            raise ValueError
+        self.refresh.assert_not_called()
+        self.assertEqual(MaterialConsumption.objects.count(), 0)
+
+        with transaction.atomic():
+            self.consumption('R1', date(2024, 1, 2), 2)
+        self.refresh.assert_called_once_with({('R1', date(2024, 1, 1)), ('R1', date(2024, 1, 2))})
+        self.assertEqual(self.totals(), {date(2024, 1, 1): Decimal('0'), date(2024, 1, 2): Decimal('5')})
@@ -3,11 +3,22 @@ from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
 from django.utils.translation import gettext
 from django.core.paginator import Paginator
-from django.http import JsonResponse, HttpResponse
-from django.db import transaction
+from django.http import Http404, JsonResponse, HttpResponse, StreamingHttpResponse
+from django.db import connection, transaction
 from django.db.models import Q, Sum
+from django.conf import settings
+from django.utils import timezone
+import hashlib
+import json
+import multiprocessing
 import threading
-from .models import MaterialConsumption, ConsumerData, ImportTask
+import time as time_module
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from .models import MaterialConsumption, ConsumerData, ImportTask, ImportTaskError, MonthlyRestaurantStats
+from . import consumer_refresh
+from .import_validation import apply_unit_conversion, init_import_worker, parse_date, validate_import_rows
 from .forms import (
     MaterialConsumptionForm, 
     DataImportForm, 
@@ -16,10 +27,11 @@ from .forms import (
     ConsumerSearchForm,
     ConsumerDataImportForm
 )
-from coefficients.models import EmissionCoefficient, EmissionCategory
+from coefficients.models import EmissionCoefficient, EmissionCategory, UnitConversion
+from coefficients.versioning import load_version_index
+from carbon_management import metrics
+from carbon_management.db import retry_on_lock
 import pandas as pd
-from datetime import datetime, date, time
-from decimal import Decimal
 from io import BytesIO
 
 
@@ -257,6 +269,40 @@ def get_products_by_category(request):
         })
 
 
+def _file_sha256(file):
+    """Hex SHA-256 of an uploaded file's content; the file is rewound for reading"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def _fail_stale_tasks(tasks):
+    """Mark unfinished tasks among tasks without progress for IMPORT_TASK_STALE_SECONDS as failed
+
+    Imports and refreshes run in daemon threads that die with their worker, so
+    such tasks will never finish and must not be treated as still running.
+    """
+    now = timezone.now()
+    tasks.filter(
+        status__in=[ImportTask.STATUS_PENDING, ImportTask.STATUS_PROCESSING],
+        updated_at__lt=now - timedelta(seconds=settings.IMPORT_TASK_STALE_SECONDS),
+    ).update(
+        status=ImportTask.STATUS_FAILED,
+        error_message=gettext('任务长时间没有进度，可能因服务重启而中断，请重新操作'),
+        updated_at=now,
+    )
+
+
+def _find_duplicate_import(kind, file_hash):
+    """Latest import of the same kind with identical file content that was not a dry run or failure"""
+    _fail_stale_tasks(ImportTask.objects.filter(kind=kind, file_hash=file_hash))
+    return ImportTask.objects.filter(
+        kind=kind, file_hash=file_hash, validate_only=False
+    ).exclude(status=ImportTask.STATUS_FAILED).order_by('-created_at').first()
+
+
 def data_import(request):
     """Import material consumption data from Excel/CSV file (async)"""
     if request.method == 'POST':
@@ -264,13 +310,27 @@ def data_import(request):
         if form.is_valid():
             file = request.FILES['file']
             try:
+                file_hash = _file_sha256(file)
+                validate_only = form.cleaned_data['validate_only']
+                if not validate_only and not form.cleaned_data['force']:
+                    duplicate_task = _find_duplicate_import(ImportTask.KIND_MATERIAL, file_hash)
+                    if duplicate_task:
+                        return render(request, 'data_entry/import_form.html', {
+                            'form': form, 'duplicate_task': duplicate_task
+                        })
+
                 if file.name.endswith('.csv'):
                     df = pd.read_csv(file)
                 else:
                     df = pd.read_excel(file)
 
                 raw_df = df.copy()
-                task = ImportTask.objects.create(total_rows=len(df))
+                task = ImportTask.objects.create(
+                    total_rows=len(df),
+                    validate_only=validate_only,
+                    mode=form.cleaned_data['mode'],
+                    file_hash=file_hash,
+                )
 
                 def run(task_id, dataframe, original_dataframe):
                     process_import_data_async(task_id, dataframe, original_dataframe)
@@ -291,11 +351,18 @@ def data_import(request):
 def import_progress(request, task_id):
     """Show import progress page"""
     task = get_object_or_404(ImportTask, id=task_id)
-    return render(request, 'data_entry/import_progress.html', {'task': task})
+    return render(request, 'data_entry/import_progress.html', {
+        'task': task,
+        'use_stream': settings.IMPORT_PROGRESS_STREAM,
+    })
 
 
 def import_progress_api(request, task_id):
-    """JSON API for polling import task progress, supports ?page= for error pagination"""
+    """JSON API for polling import task progress
+
+    Errors are paged from ImportTaskError: ?page= uses LIMIT/OFFSET, ?after=<row>
+    continues after the given row number with a keyset query.
+    """
     task = get_object_or_404(ImportTask, id=task_id)
     percent = 0
     if task.total_rows > 0:
@@ -305,17 +372,24 @@ def import_progress_api(request, task_id):
         page = max(1, int(request.GET.get('page', 1)))
     except (ValueError, TypeError):
         page = 1
-    all_errors = task.error_details or []
-    start = (page - 1) * page_size
-    end = start + page_size
-    total_pages = max(1, (len(all_errors) + page_size - 1) // page_size)
+    errors_qs = task.errors.order_by('row').values('row', 'error')
+    try:
+        after = int(request.GET['after'])
+    except (KeyError, ValueError, TypeError):
+        start = (page - 1) * page_size
+        errors = list(errors_qs[start:start + page_size])
+    else:
+        errors = list(errors_qs.filter(row__gt=after)[:page_size])
+    total_pages = max(1, (task.error_count + page_size - 1) // page_size)
     return JsonResponse({
         'status': task.status,
         'total_rows': task.total_rows,
         'processed_rows': task.processed_rows,
         'success_count': task.success_count,
-        'error_count': len(all_errors),
-        'errors': all_errors[start:end],
+        'error_count': task.error_count,
+        'deleted_count': task.deleted_count,
+        'errors': errors,
+        'next_after': errors[-1]['row'] if len(errors) == page_size else None,
         'error_message': task.error_message,
         'percent': percent,
         'page': page,
@@ -323,6 +397,61 @@ def import_progress_api(request, task_id):
     })
 
 
+# Lifetime of one progress stream, kept below the gunicorn worker timeout;
+# EventSource reconnects on its own when the stream ends.
+IMPORT_STREAM_MAX_SECONDS = 50
+# Seconds between ImportTask reads, the same rate as the polling fallback
+IMPORT_STREAM_INTERVAL = 2
+IMPORT_STREAM_FIELDS = ['status', 'total_rows', 'processed_rows', 'success_count', 'error_count', 'error_message']
+
+
+def import_progress_stream(request, task_id):
+    """Server-Sent Events stream of import task progress
+
+    Each event carries only the fields that changed since the previous one and is
+    sent only when processed_rows or status moves. The stream ends when the task
+    finishes; the progress page falls back to polling import_progress_api.
+
+    Only available with settings.IMPORT_PROGRESS_STREAM, since each open stream
+    holds a worker for up to IMPORT_STREAM_MAX_SECONDS.
+    """
+    if not settings.IMPORT_PROGRESS_STREAM:
+        raise Http404
+    get_object_or_404(ImportTask, id=task_id)
+
+    def events():
+        yield 'retry: 2000\n\n'
+        sent = {}
+        started = last_sent = time_module.monotonic()
+        while True:
+            state = ImportTask.objects.filter(id=task_id).values(*IMPORT_STREAM_FIELDS).first()
+            if state is None:
+                return
+            if (state['status'], state['processed_rows']) != (sent.get('status'), sent.get('processed_rows')):
+                state['percent'] = 0
+                if state['total_rows'] > 0:
+                    state['percent'] = int(state['processed_rows'] / state['total_rows'] * 100)
+                delta = {key: value for key, value in state.items() if sent.get(key) != value}
+                sent.update(delta)
+                last_sent = time_module.monotonic()
+                yield f'data: {json.dumps(delta)}\n\n'
+            if state['status'] in (ImportTask.STATUS_DONE, ImportTask.STATUS_FAILED):
+                return
+            now = time_module.monotonic()
+            if now - started > IMPORT_STREAM_MAX_SECONDS:
+                return
+            if now - last_sent > 15:
+                # Comment line keeps proxies from closing an idle stream
+                last_sent = now
+                yield ': keepalive\n\n'
+            time_module.sleep(IMPORT_STREAM_INTERVAL)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def import_error_export(request, task_id):
     """Download failed import rows with the failure reason in the last column"""
     task = get_object_or_404(ImportTask, id=task_id)
@@ -342,37 +471,162 @@ def import_error_export(request, task_id):
     return HttpResponse(gettext('失败数据文件不存在，请重新导入后再下载。'), status=404)
 
 
-def _parse_date(val):
-    """Parse a date value from various formats, return date or raise ValueError."""
-    if isinstance(val, str):
-        date_str = val.strip()
-        for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d'):
-            try:
-                return datetime.strptime(date_str, fmt).date()
-            except ValueError:
-                continue
-        raise ValueError(date_str)
-    return pd.to_datetime(val).date()
+# Rows validated and committed per transaction during material imports
+IMPORT_CHUNK_SIZE = 2000
+
+
+def _build_import_lookups():
+    """Load categories and coefficients once into plain, picklable lookup dicts"""
+    quantity_field = MaterialConsumption._meta.get_field('quantity')
+    return {
+        'level1': {
+            name: pk for name, pk in EmissionCategory.objects.filter(level=1).values_list('name', 'pk')
+        },
+        'level2': {
+            (name, parent_id): pk
+            for name, parent_id, pk in EmissionCategory.objects.filter(level=2).values_list('name', 'parent_id', 'pk')
+        },
+        'coefficients': {
+            (level1_id, level2_id): (unit, coefficient)
+            for level1_id, level2_id, unit, coefficient in EmissionCoefficient.objects.values_list(
+                'category_level1_id', 'category_level2_id', 'unit', 'coefficient'
+            )
+        },
+        'versions': load_version_index(),
+        'unit_conversions': {
+            (product_code.strip(), from_unit.strip().lower(), to_unit): factor
+            for product_code, from_unit, to_unit, factor in UnitConversion.objects.values_list(
+                'product_code', 'from_unit', 'to_unit', 'factor'
+            )
+        },
+        'quantity_digits': (quantity_field.max_digits, quantity_field.decimal_places),
+    }
+
 
+def _iter_import_chunks(df):
+    """Yield the dataframe as lists of (row_num, row dict), IMPORT_CHUNK_SIZE rows at a time"""
+    for start in range(0, len(df), IMPORT_CHUNK_SIZE):
+        chunk = df.iloc[start:start + IMPORT_CHUNK_SIZE]
+        yield list(zip((chunk.index + 2).tolist(), chunk.to_dict('records')))
 
-def _parse_time(val):
-    """Parse a time value, return time or raise ValueError."""
-    from datetime import time as time_type
-    if isinstance(val, time_type):
-        return val
-    if isinstance(val, str):
-        time_str = val.strip()
+
+def _validate_chunks_in_pool(executor, chunks, window):
+    """Validate chunks in the pool with at most window chunks in flight, yielding results in order
+
+    Unlike executor.map, which submits (and so converts and pickles) every chunk
+    up front, later chunks are only built as earlier results are consumed.
+    """
+    pending = deque()
+    for records in chunks:
+        pending.append(executor.submit(validate_import_rows, records))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _existing_import_keys(df):
+    """Unique keys of the stored records within the file's restaurants and date range"""
+    restaurants = {str(value).strip() for value in df['restaurant'].dropna().unique()} - {''}
+    dates = set()
+    for value in df['order_date'].dropna().unique():
         try:
-            return datetime.strptime(time_str, '%H:%M:%S').time()
-        except ValueError:
-            return datetime.strptime(time_str, '%H:%M').time()
-    if hasattr(val, 'time'):
-        return val.time() if callable(val.time) else val.time
-    return pd.to_datetime(val).time()
+            dates.add(parse_date(value))
+        except Exception:
+            continue
+    date_filter = Q(order_date__isnull=True) if df['order_date'].isna().any() else Q(pk__in=[])
+    if dates:
+        date_filter |= Q(order_date__range=(min(dates), max(dates)))
+    return set(
+        MaterialConsumption.objects.filter(date_filter, restaurant__in=restaurants).values_list(
+            'restaurant', 'category_level1_id', 'category_level2_id',
+            'product_name', 'order_date', 'consumption_time', 'quantity'
+        )
+    )
+
+
+def _hold_back_failed_partitions(validated_chunks, df):
+    """Validate a whole replace import before anything is deleted
+
+    A restaurant with any row that failed validation keeps its existing records:
+    its valid rows are reported as errors instead of being written. Returns the
+    validated chunks with those rows moved to the errors and the partition scope
+    {restaurant: (first_date, last_date)} covered by the remaining valid rows.
+    """
+    validated_chunks = list(validated_chunks)
+    held = set()
+    for valid, chunk_errors in validated_chunks:
+        for error in chunk_errors:
+            restaurant = df.at[error['row'] - 2, 'restaurant']
+            if pd.notna(restaurant) and str(restaurant).strip():
+                held.add(str(restaurant).strip())
+
+    scope = {}
+    kept_chunks = []
+    for valid, chunk_errors in validated_chunks:
+        kept = []
+        for row_num, values in valid:
+            restaurant = values['restaurant']
+            if restaurant in held:
+                chunk_errors.append({
+                    'row': row_num,
+                    'error': gettext('餐厅 "%(restaurant)s" 有未通过校验的行，未替换该餐厅的数据') % {
+                        'restaurant': restaurant
+                    }
+                })
+                continue
+            kept.append((row_num, values))
+            order_date = values['order_date']
+            if order_date is not None:
+                first, last = scope.get(restaurant, (order_date, order_date))
+                scope[restaurant] = (min(first, order_date), max(last, order_date))
+        kept_chunks.append((kept, chunk_errors))
+    return kept_chunks, scope
+
+
+def _delete_partition_scope(scope, batch_size=5000):
+    """Delete the records inside an import scope in batches, each in its own transaction
+
+    Returns (deleted count, set of affected (restaurant, order_date) keys).
+    """
+    if not scope:
+        return 0, set()
+    condition = Q()
+    for restaurant, (first, last) in scope.items():
+        condition |= Q(restaurant=restaurant, order_date__range=(first, last))
+
+    queryset = MaterialConsumption.objects.filter(condition)
+    affected_keys = set(queryset.values_list('restaurant', 'order_date').distinct())
+    ids = list(queryset.values_list('pk', flat=True))
+    for start in range(0, len(ids), batch_size):
+        _delete_consumptions(ids[start:start + batch_size])
+    return len(ids), affected_keys
+
+
+@retry_on_lock
+def _delete_consumptions(ids):
+    with transaction.atomic():
+        MaterialConsumption.objects.filter(pk__in=ids).delete()
+
+
+@retry_on_lock
+def _write_consumptions(objs):
+    with transaction.atomic():
+        MaterialConsumption.objects.bulk_create(objs, batch_size=IMPORT_CHUNK_SIZE)
 
 
-def process_import_data(df, task=None):
-    """Process imported data and validate"""
+def process_import_data(df, task=None, validate_only=False, mode=ImportTask.MODE_APPEND):
+    """Process imported data and validate
+
+    With validate_only, every check runs (including duplicates against existing
+    records) and the result reports what would be imported, but nothing is written.
+
+    In MODE_REPLACE the file defines a partition per restaurant (its first to last
+    order date); existing records in those partitions are deleted in batches before
+    the new rows are inserted, so no duplicate lookups against them are needed.
+    The whole file is validated first and a restaurant with failed rows is not
+    replaced at all, so a bad file never deletes data it does not put back.
+    """
     required_columns = ['餐厅', '产品编码', '一级分类', '二级分类', '产品名称', '订单日期', '消耗数量']
     column_mapping = {
         '餐厅': 'restaurant',
@@ -383,6 +637,7 @@ def process_import_data(df, task=None):
         '订单日期': 'order_date',
         '消耗时间': 'consumption_time',
         '消耗数量': 'quantity',
+        '单位': 'unit',
     }
 
     missing_columns = [col for col in required_columns if col not in df.columns]
@@ -396,175 +651,170 @@ def process_import_data(df, task=None):
     df = df.rename(columns=rename_map)
 
     # Pre-load all categories and coefficients into memory to avoid per-row queries
-    level1_map = {obj.name: obj for obj in EmissionCategory.objects.filter(level=1)}
-    level2_map = {(obj.name, obj.parent_id): obj for obj in EmissionCategory.objects.filter(level=2)}
-    coeff_map = {
-        (obj.category_level1_id, obj.category_level2_id): obj
-        for obj in EmissionCoefficient.objects.all()
-    }
-
-    # Pre-load existing record unique keys to avoid per-row duplicate checks
-    existing_keys = set(
-        MaterialConsumption.objects.values_list(
-            'restaurant', 'category_level1_id', 'category_level2_id',
-            'product_name', 'order_date', 'consumption_time', 'quantity'
-        )
-    )
+    lookups = _build_import_lookups()
+    df = apply_unit_conversion(df, lookups)
 
     success_count = 0
+    error_count = 0
+    deleted_count = 0
     errors = []
-    to_create = []
-    total = len(df)
-
-    for index, row in df.iterrows():
-        row_num = index + 2
-        try:
-            # Restaurant
-            restaurant = str(row['restaurant']).strip()
-            if not restaurant:
-                errors.append({'row': row_num, 'error': gettext('餐厅不能为空')})
-                continue
-
-            # Categories (in-memory lookup)
-            level1_name = str(row['category_level1']).strip()
-            level2_name = str(row['category_level2']).strip()
+    affected_keys = set()
 
-            category_level1 = level1_map.get(level1_name)
-            if not category_level1:
-                errors.append({
-                    'row': row_num,
-                    'error': gettext('一级分类 "%(category)s" 不存在') % {'category': level1_name}
-                })
-                continue
-
-            category_level2 = level2_map.get((level2_name, category_level1.pk))
-            if not category_level2:
-                errors.append({
-                    'row': row_num,
-                    'error': gettext('二级分类 "%(level2)s" 不存在或不属于 "%(level1)s"') % {
-                        'level2': level2_name, 'level1': level1_name
-                    }
-                })
-                continue
-
-            # Product code
-            product_code = str(row['product_code']).strip() if pd.notna(row.get('product_code')) else ''
-            if not product_code:
-                errors.append({'row': row_num, 'error': gettext('产品编码不能为空')})
-                continue
-
-            product_name = str(row['product_name']).strip()
-
-            # Coefficient (in-memory lookup)
-            coefficient = coeff_map.get((category_level1.pk, category_level2.pk))
-            if not coefficient:
-                errors.append({'row': row_num, 'error': gettext('未找到匹配的碳排放系数')})
-                continue
+    if mode == ImportTask.MODE_REPLACE:
+        # Every row falls inside the replaced partitions, so only in-file duplicates matter
+        existing_keys = set()
+    else:
+        # Pre-load the unique keys rows of this file could collide with, instead of
+        # per-row duplicate checks (or the whole table, for validate-only previews)
+        existing_keys = _existing_import_keys(df)
 
-            product_unit = coefficient.unit
-            emission_coefficient = coefficient.coefficient
+    total = len(df)
+    processed = 0
+
+    # Large files are validated by a pool of worker processes sharing the read-only
+    # lookups; results come back in chunk order and this thread stays the only writer.
+    workers = settings.IMPORT_PARALLEL_WORKERS
+    executor = None
+    if workers > 1 and total >= settings.IMPORT_PARALLEL_MIN_ROWS:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_import_worker,
+            initargs=(lookups,),
+        )
+        validated_chunks = _validate_chunks_in_pool(executor, _iter_import_chunks(df), window=2 * workers)
+    else:
+        validated_chunks = (validate_import_rows(records, lookups) for records in _iter_import_chunks(df))
 
-            # Parse date
-            order_date = None
-            if pd.notna(row['order_date']):
-                try:
-                    order_date = _parse_date(row['order_date'])
-                except Exception:
-                    errors.append({
+    # Insert chunk by chunk: each chunk commits in its own short transaction, so
+    # progress reflects rows actually written, other writers can interleave between
+    # chunks and a failed insert only loses that chunk.
+    try:
+        if mode == ImportTask.MODE_REPLACE:
+            validated_chunks, scope = _hold_back_failed_partitions(validated_chunks, df)
+            if not validate_only:
+                deleted_count, affected_keys = _delete_partition_scope(scope)
+
+        for valid, chunk_errors in validated_chunks:
+            processed += len(valid) + len(chunk_errors)
+            chunk_keys = []
+            chunk_rows = []
+            to_create = []
+
+            for row_num, values in valid:
+                # Duplicate check (in-memory)
+                dup_key = (
+                    values['restaurant'], values['category_level1_id'], values['category_level2_id'],
+                    values['product_name'], values['order_date'], values['consumption_time'], values['quantity'],
+                )
+                if dup_key in existing_keys:
+                    chunk_errors.append({
                         'row': row_num,
-                        'error': gettext('日期格式错误：%(date)s') % {'date': row['order_date']}
+                        'error': gettext('重复记录：该餐厅、产品在此日期且消耗数量相同的记录已存在')
                     })
                     continue
 
-            # Parse time (optional)
-            consumption_time = None
-            if 'consumption_time' in df.columns and pd.notna(row.get('consumption_time')):
+                existing_keys.add(dup_key)
+                chunk_keys.append(dup_key)
+                chunk_rows.append(row_num)
+                to_create.append(MaterialConsumption(
+                    **values,
+                    # Pre-calculate carbon_emission (bulk_create skips save())
+                    carbon_emission=values['quantity'] * values['emission_coefficient'],
+                ))
+
+            if validate_only:
+                success_count += len(to_create)
+            elif to_create:
                 try:
-                    consumption_time = _parse_time(row['consumption_time'])
-                except Exception:
-                    errors.append({
-                        'row': row_num,
-                        'error': gettext('时间格式错误：%(time)s') % {'time': str(row['consumption_time'])}
-                    })
-                    continue
+                    _write_consumptions(to_create)
+                except Exception as e:
+                    existing_keys.difference_update(chunk_keys)
+                    chunk_errors.extend(
+                        {'row': row_num, 'error': gettext('写入失败：%(error)s') % {'error': str(e)}}
+                        for row_num in chunk_rows
+                    )
+                else:
+                    success_count += len(to_create)
+                    affected_keys.update((obj.restaurant, obj.order_date) for obj in to_create)
+            chunk_errors.sort(key=lambda item: item['row'])
+            error_count += len(chunk_errors)
+
+            if task is not None:
+                _save_task_errors(task, chunk_errors)
+                task.processed_rows = processed
+                task.success_count = success_count
+                task.error_count = error_count
+                task.save(update_fields=['processed_rows', 'success_count', 'error_count', 'updated_at'])
+            else:
+                errors.extend(chunk_errors)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        # bulk_create bypasses MaterialConsumption.save, so bring the daily totals of
+        # the touched restaurant/days up to date in one pass, even if the import stopped early
+        consumer_refresh.mark_dirty(affected_keys)
 
-            # Parse quantity
-            try:
-                quantity = float(row['quantity'])
-                if quantity < 0:
-                    errors.append({'row': row_num, 'error': gettext('消耗数量不能为负数')})
-                    continue
-            except Exception:
-                errors.append({
-                    'row': row_num,
-                    'error': gettext('消耗数量格式错误：%(quantity)s') % {'quantity': row['quantity']}
-                })
-                continue
+    return {
+        'success': True,
+        'success_count': success_count,
+        'error_count': error_count,
+        'deleted_count': deleted_count,
+        # Without a task the errors are returned here; otherwise they are in task.errors
+        'errors': errors,
+        'total_rows': len(df)
+    }
 
-            # Duplicate check (in-memory)
-            dup_key = (restaurant, category_level1.pk, category_level2.pk, product_name, order_date, consumption_time, Decimal(str(quantity)))
-            if dup_key in existing_keys:
-                errors.append({
-                    'row': row_num,
-                    'error': gettext('重复记录：该餐厅、产品在此日期且消耗数量相同的记录已存在')
-                })
-                continue
 
-            existing_keys.add(dup_key)
-            to_create.append(MaterialConsumption(  # noqa
-                restaurant=restaurant,
-                product_code=product_code,
-                category_level1=category_level1,
-                category_level2=category_level2,
-                product_name=product_name,
-                order_date=order_date,
-                consumption_time=consumption_time,
-                quantity=Decimal(str(quantity)),
-                product_unit=product_unit,
-                emission_coefficient=emission_coefficient,
-            ))
-            success_count += 1
+@retry_on_lock
+def _save_task_errors(task, errors):
+    """Bulk-insert row errors for an import task"""
+    ImportTaskError.objects.bulk_create(
+        [ImportTaskError(task=task, row=e['row'], error=e['error']) for e in errors],
+        batch_size=1000,
+    )
 
-        except Exception as e:
-            errors.append({
-                'row': row_num,
-                'error': gettext('处理失败：%(error)s') % {'error': str(e)}
-            })
 
-        # Update progress every 500 rows
-        if task is not None and (index + 1) % 500 == 0:
-            task.processed_rows = index + 1
-            task.save(update_fields=['processed_rows', 'updated_at'])
+def _write_import_error_file(task, raw_df):
+    """Write the failed rows plus their reason to an xlsx, streaming from ImportTaskError
 
-    # Pre-calculate carbon_emission (bulk_create skips save())
-    for obj in to_create:
-        obj.carbon_emission = obj.quantity * obj.emission_coefficient
+    Returns the path relative to MEDIA_ROOT.
+    """
+    import os
+    from openpyxl import Workbook
 
-    # Bulk insert in batches of 2000
-    if to_create:
-        with transaction.atomic():
-            MaterialConsumption.objects.bulk_create(to_create, batch_size=2000)
+    save_dir = os.path.join(str(settings.MEDIA_ROOT), 'import_errors')
+    os.makedirs(save_dir, exist_ok=True)
+    filename = f'import_errors_{task.id}.xlsx'
 
-    return {
-        'success': True,
-        'success_count': success_count,
-        'errors': errors,
-        'total_rows': len(df)
-    }
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append([str(col) for col in raw_df.columns] + ['失败原因'])
+    raw_values = raw_df.to_numpy(dtype=object)
+    for row, error in task.errors.order_by('row').values_list('row', 'error').iterator(chunk_size=2000):
+        pos = row - 2
+        if 0 <= pos < len(raw_values):
+            ws.append([None if pd.isna(value) else value for value in raw_values[pos]] + [error])
+    wb.save(os.path.join(save_dir, filename))
+    return f'import_errors/{filename}'
 
 
-def process_import_data_async(task_id, df, raw_df=None):
-    """Run process_import_data in background thread, updating ImportTask progress"""
+def _run_import_task(task_id, raw_df, process):
+    """Run an import in a background thread, recording progress and outcome on its ImportTask
+
+    process(task) does the work and returns the importer's result dict.
+    """
     import django
     django.setup.__module__  # ensure app registry is ready
 
     from .models import ImportTask
+    started = time_module.monotonic()
     try:
         task = ImportTask.objects.get(id=task_id)
         task.status = ImportTask.STATUS_PROCESSING
         task.save(update_fields=['status', 'updated_at'])
 
-        result = process_import_data(df, task=task)
+        result = process(task)
 
         if not result.get('success'):
             task.status = ImportTask.STATUS_FAILED
@@ -575,45 +825,26 @@ def process_import_data_async(task_id, df, raw_df=None):
 
         # Build error file if there are failed rows
         error_file_path = ''
-        if result.get('errors'):
-            from django.conf import settings
-            import os
-            orig = raw_df
-            error_positions = [
-                e['row'] - 2 for e in result['errors']
-                if e.get('row') is not None and e['row'] >= 2
-            ]
-            error_reasons = {
-                e['row'] - 2: e['error'] for e in result['errors']
-                if e.get('row') is not None and e['row'] >= 2
-            }
-            if orig is not None and error_positions:
-                try:
-                    valid_positions = [pos for pos in error_positions if 0 <= pos < len(orig)]
-                    err_df = orig.iloc[valid_positions].copy()
-                    err_df['失败原因'] = [error_reasons.get(pos, '') for pos in valid_positions]
-                    media_root = str(settings.MEDIA_ROOT)
-                    save_dir = os.path.join(media_root, 'import_errors')
-                    os.makedirs(save_dir, exist_ok=True)
-                    filename = f'import_errors_{task_id}.xlsx'
-                    filepath = os.path.join(save_dir, filename)
-                    err_df.to_excel(filepath, index=False)
-                    if os.path.exists(filepath):
-                        error_file_path = f'import_errors/{filename}'
-                except Exception as file_err:
-                    task.error_message = gettext('失败数据文件生成失败：%(error)s') % {'error': str(file_err)}
-
-        errors_for_db = [{'row': e['row'], 'error': e['error']} for e in result['errors']]
+        if result['error_count'] and raw_df is not None:
+            try:
+                error_file_path = _write_import_error_file(task, raw_df)
+            except Exception as file_err:
+                task.error_message = gettext('失败数据文件生成失败：%(error)s') % {'error': str(file_err)}
 
         task.status = ImportTask.STATUS_DONE
         task.success_count = result['success_count']
-        task.error_details = errors_for_db
+        task.error_count = result['error_count']
+        task.deleted_count = result.get('deleted_count', 0)
         task.processed_rows = result['total_rows']
         task.error_file = error_file_path
         task.save(update_fields=[
-            'status', 'success_count', 'error_details', 'processed_rows',
+            'status', 'success_count', 'error_count', 'deleted_count', 'processed_rows',
             'error_file', 'error_message', 'updated_at'
         ])
+        metrics.record_import(
+            task.kind, task.processed_rows, task.success_count, task.error_count,
+            time_module.monotonic() - started,
+        )
     except Exception as e:
         try:
             task = ImportTask.objects.get(id=task_id)
@@ -622,6 +853,17 @@ def process_import_data_async(task_id, df, raw_df=None):
             task.save(update_fields=['status', 'error_message', 'updated_at'])
         except Exception:
             pass
+    finally:
+        # Request cleanup never runs in this thread; release its connection so
+        # persistent connections (CONN_MAX_AGE) do not pile up per import
+        connection.close()
+
+
+def process_import_data_async(task_id, df, raw_df=None):
+    """Run process_import_data in background thread, updating ImportTask progress"""
+    _run_import_task(task_id, raw_df, lambda task: process_import_data(
+        df, task=task, validate_only=task.validate_only, mode=task.mode
+    ))
 
 
 def download_import_template(request):
@@ -635,7 +877,8 @@ def download_import_template(request):
         '消耗时间',
         '一级分类',
         '二级分类',
-        '消耗数量'
+        '消耗数量',
+        '单位'
     ])
     
     # Add sample data
@@ -647,7 +890,8 @@ def download_import_template(request):
         '10:30:00',
         '示例一级分类',
         '示例二级分类',
-        '100'
+        '100',
+        'KG'
     ]
     
     # Create Excel file in memory
@@ -751,7 +995,7 @@ def consumption_export(request):
 
 def consumer_list(request):
     """List all consumer data records"""
-    consumers = ConsumerData.objects.all()
+    consumers = MonthlyRestaurantStats.annotate_consumers(ConsumerData.objects.all())
     
     # Search form
     search_form = ConsumerSearchForm(request.GET)
@@ -782,51 +1026,24 @@ def consumer_list(request):
         'order_date': 'order_date',
         'consumer_count': 'consumer_count',
         'daily_carbon_emission': 'daily_carbon_emission',
+        'adjusted_daily_carbon_emission': 'adjusted_daily_carbon_emission',
     }
     
     if sort_by.lstrip('-') in valid_sorts:
         actual_sort_field = valid_sorts[sort_by.lstrip('-')]
+        # pk keeps pagination stable when many rows share the sort value
         if order == 'asc':
-            consumers = consumers.order_by(actual_sort_field)
+            consumers = consumers.order_by(actual_sort_field, 'pk')
         else:
-            consumers = consumers.order_by(f'-{actual_sort_field}')
+            consumers = consumers.order_by(f'-{actual_sort_field}', '-pk')
     else:
         consumers = consumers.order_by('-order_date', '-created_at')
     
-    # Pagination
+    # Pagination (adjusted emission is annotated in the same query)
     paginator = Paginator(consumers, 20)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
-    # Calculate adjusted carbon emission for each record in current page
-    for consumer in page_obj:
-        # Get the year and month of this record
-        if not consumer.order_date:
-            consumer.adjusted_emission = None
-            continue
-        year = consumer.order_date.year
-        month = consumer.order_date.month
-        
-        # Query all records for the same restaurant and month
-        monthly_data = ConsumerData.objects.filter(
-            restaurant=consumer.restaurant,
-            order_date__year=year,
-            order_date__month=month
-        ).aggregate(
-            total_emission=Sum('daily_carbon_emission'),
-            total_consumers=Sum('consumer_count')
-        )
-        
-        # Calculate adjusted carbon emission
-        total_emission = monthly_data['total_emission'] or Decimal('0')
-        total_consumers = monthly_data['total_consumers'] or 0
-        
-        if total_consumers > 0:
-            # Formula: (当月总碳排 / 当月总人数) × 当日消费者人数
-            consumer.adjusted_daily_carbon_emission = (total_emission / Decimal(total_consumers)) * Decimal(consumer.consumer_count)
-        else:
-            consumer.adjusted_daily_carbon_emission = Decimal('0')
-    
     context = {
         'page_obj': page_obj,
         'current_sort': sort_by.lstrip('-'),
@@ -888,57 +1105,162 @@ def consumer_delete(request, pk):
 
 
 def consumer_refresh_emissions(request):
-    """Refresh all daily carbon emissions for consumer data"""
+    """Start a background refresh of consumer daily carbon emissions
+
+    POST only. The optional query/start_date/end_date fields narrow the refresh
+    the same way as the consumer list filters. An unfinished refresh of the same
+    scope is reused rather than started twice.
+
+    Refresh tasks that stopped making progress are marked failed first instead
+    of being reused forever.
+    """
+    if request.method != 'POST':
+        return redirect('consumer_list')
+
+    scope = {
+        'query': request.POST.get('query', '').strip(),
+        'start_date': request.POST.get('start_date', '').strip() or None,
+        'end_date': request.POST.get('end_date', '').strip() or None,
+    }
+    scope_hash = hashlib.sha256(json.dumps(scope, sort_keys=True).encode('utf-8')).hexdigest()
+
+    _fail_stale_tasks(ImportTask.objects.filter(kind=ImportTask.KIND_REFRESH))
+    running = ImportTask.objects.filter(
+        kind=ImportTask.KIND_REFRESH,
+        scope_hash=scope_hash,
+        status__in=[ImportTask.STATUS_PENDING, ImportTask.STATUS_PROCESSING],
+    ).order_by('-created_at').first()
+    if running:
+        messages.info(request, _('已有刷新任务正在进行'))
+        return redirect('import_progress', task_id=str(running.id))
+
     try:
-        consumers = ConsumerData.objects.all()
-        updated_count = 0
-        
-        for consumer in consumers:
-            old_emission = consumer.daily_carbon_emission
-            consumer.daily_carbon_emission = consumer.calculate_daily_emission()
-            if old_emission != consumer.daily_carbon_emission:
-                consumer.save(update_fields=['daily_carbon_emission', 'updated_at'])
-                updated_count += 1
-        
-        messages.success(request, _('成功刷新 %(count)s 条记录的碳排放数据') % {'count': updated_count})
+        task = ImportTask.objects.create(
+            kind=ImportTask.KIND_REFRESH,
+            scope_hash=scope_hash,
+            total_rows=_consumer_refresh_queryset(**scope).count(),
+        )
     except Exception as e:
         messages.error(request, _('刷新失败：%(error)s') % {'error': str(e)})
-    
-    return redirect('consumer_list')
+        return redirect('consumer_list')
+
+    t = threading.Thread(
+        target=process_consumer_refresh_async,
+        args=(str(task.id), scope),
+        daemon=True
+    )
+    t.start()
+
+    return redirect('import_progress', task_id=str(task.id))
+
+
+def _consumer_refresh_queryset(query='', start_date=None, end_date=None, model=ConsumerData):
+    """Rows of model (ConsumerData or MaterialConsumption) inside a refresh scope"""
+    queryset = model.objects.all()
+    if query:
+        queryset = queryset.filter(restaurant__icontains=query)
+    if start_date:
+        queryset = queryset.filter(order_date__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(order_date__lte=end_date)
+    return queryset
+
+
+def process_consumer_refresh(task=None, query='', start_date=None, end_date=None):
+    """Recompute daily_carbon_emission for the consumer rows in scope
+
+    All daily totals come from one grouped query over MaterialConsumption; the
+    consumer rows are then compared in chunks and changed ones bulk-updated, with
+    progress saved on the task after each chunk.
+    """
+    scope = {'query': query, 'start_date': start_date, 'end_date': end_date}
+    totals = {
+        (item['restaurant'], item['order_date']): item['total']
+        for item in _consumer_refresh_queryset(model=MaterialConsumption, **scope).order_by().values(
+            'restaurant', 'order_date'
+        ).annotate(total=Sum('carbon_emission'))
+    }
+
+    consumers = _consumer_refresh_queryset(**scope).order_by('pk').only(
+        'pk', 'restaurant', 'order_date', 'daily_carbon_emission'
+    )
+    processed = 0
+    updated_count = 0
+    changed = []
+    now = timezone.now()
+    for consumer in consumers.iterator(chunk_size=IMPORT_CHUNK_SIZE):
+        processed += 1
+        total = totals.get((consumer.restaurant, consumer.order_date)) or 0
+        if consumer.daily_carbon_emission != total:
+            consumer.daily_carbon_emission = total
+            consumer.updated_at = now
+            changed.append(consumer)
+        if processed % IMPORT_CHUNK_SIZE == 0:
+            updated_count += _save_refreshed_consumers(changed)
+            changed = []
+            if task is not None:
+                task.processed_rows = processed
+                task.success_count = updated_count
+                task.save(update_fields=['processed_rows', 'success_count', 'updated_at'])
+    updated_count += _save_refreshed_consumers(changed)
+
+    return {
+        'success': True,
+        'success_count': updated_count,
+        'error_count': 0,
+        'total_rows': processed,
+    }
+
+
+@retry_on_lock
+def _save_refreshed_consumers(changed):
+    if changed:
+        with transaction.atomic():
+            ConsumerData.objects.bulk_update(changed, ['daily_carbon_emission', 'updated_at'], batch_size=1000)
+            MonthlyRestaurantStats.refresh_months((consumer.restaurant, consumer.order_date) for consumer in changed)
+    return len(changed)
+
+
+def process_consumer_refresh_async(task_id, scope):
+    """Run process_consumer_refresh in background thread, updating ImportTask progress"""
+    _run_import_task(task_id, None, lambda task: process_consumer_refresh(task, **scope))
 
 
 def consumer_import(request):
-    """Import consumer data from Excel/CSV file"""
+    """Import consumer data from Excel/CSV file (async)"""
     if request.method == 'POST':
         form = ConsumerDataImportForm(request.POST, request.FILES)
         if form.is_valid():
             file = request.FILES['file']
             
             try:
+                file_hash = _file_sha256(file)
+                if not form.cleaned_data['force']:
+                    duplicate_task = _find_duplicate_import(ImportTask.KIND_CONSUMER, file_hash)
+                    if duplicate_task:
+                        return render(request, 'data_entry/consumer_import_form.html', {
+                            'form': form, 'duplicate_task': duplicate_task
+                        })
+                
                 # Read file based on extension
                 if file.name.endswith('.csv'):
                     df = pd.read_csv(file)
                 else:
                     df = pd.read_excel(file)
                 
-                # Process the data
-                result = process_consumer_import_data(df)
+                raw_df = df.copy()
+                task = ImportTask.objects.create(
+                    kind=ImportTask.KIND_CONSUMER, total_rows=len(df), file_hash=file_hash
+                )
                 
-                if result['success']:
-                    messages.success(
-                        request,
-                        gettext('成功导入 %(count)s 条记录') % {'count': result["success_count"]}
-                    )
-                    if result['errors']:
-                        messages.warning(
-                            request,
-                            gettext('失败 %(count)s 条记录，详情见下方') % {'count': len(result["errors"])}
-                        )
-                    return render(request, 'data_entry/consumer_import_result.html', {
-                        'result': result
-                    })
-                else:
-                    messages.error(request, gettext('导入失败：%(error)s') % {'error': result['error']})
+                t = threading.Thread(
+                    target=process_consumer_import_data_async,
+                    args=(str(task.id), df, raw_df),
+                    daemon=True
+                )
+                t.start()
+                
+                return redirect('import_progress', task_id=str(task.id))
                     
             except Exception as e:
                 messages.error(request, gettext('文件处理失败：%(error)s') % {'error': str(e)})
@@ -951,8 +1273,11 @@ def consumer_import(request):
     return render(request, 'data_entry/consumer_import_form.html', context)
 
 
-def process_consumer_import_data(df):
-    """Process imported consumer data and validate"""
+def process_consumer_import_data(df, task=None):
+    """Process imported consumer data and validate
+
+    With a task, progress is reported on it and row errors go to ImportTaskError.
+    """
     # Expected column mapping (Chinese to English)
     column_mapping = {
         '餐厅': 'restaurant',
@@ -978,90 +1303,144 @@ def process_consumer_import_data(df):
     # Results tracking
     success_count = 0
     errors = []
+    candidates = []
     
-    # Process each row
-    with transaction.atomic():
-        for index, row in df.iterrows():
-            row_num = index + 2  # Excel row (1-indexed + header)
+    # Validate each row in memory
+    for position, (index, row) in enumerate(df.iterrows(), start=1):
+        row_num = index + 2  # Excel row (1-indexed + header)
+        if task is not None and position % IMPORT_CHUNK_SIZE == 0:
+            task.processed_rows = position
+            task.save(update_fields=['processed_rows', 'updated_at'])
+        
+        try:
+            # Validate restaurant
+            restaurant = str(row['restaurant']).strip()
+            if not restaurant:
+                errors.append({
+                    'row': row_num,
+                    'error': gettext('餐厅不能为空')
+                })
+                continue
             
+            # Parse order date
             try:
-                # Validate restaurant
-                restaurant = str(row['restaurant']).strip()
-                if not restaurant:
-                    errors.append({
-                        'row': row_num,
-                        'error': gettext('餐厅不能为空')
-                    })
-                    continue
-                
-                # Parse order date
-                try:
-                    order_date = pd.to_datetime(row['order_date']).date()
-                except:
-                    errors.append({
-                        'row': row_num,
-                        'error': gettext('日期格式错误：%(date)s') % {'date': row['order_date']}
-                    })
-                    continue
-                
-                # Parse consumer count
-                try:
-                    consumer_count = int(row['consumer_count'])
-                    if consumer_count <= 0:
-                        errors.append({
-                            'row': row_num,
-                            'error': gettext('消费者人数必须大于0')
-                        })
-                        continue
-                except:
-                    errors.append({
-                        'row': row_num,
-                        'error': gettext('消费者人数格式错误：%(count)s') % {'count': row['consumer_count']}
-                    })
-                    continue
-                
-                # Get notes (optional)
-                notes = ''
-                if 'notes' in row and pd.notna(row['notes']):
-                    notes = str(row['notes']).strip()
-                
-                # Check if record already exists
-                existing_record = ConsumerData.objects.filter(
-                    restaurant=restaurant,
-                    order_date=order_date,
-                ).first()
-                
-                if existing_record:
-                    # Record already exists - treat as error
+                order_date = pd.to_datetime(row['order_date']).date()
+            except Exception:
+                errors.append({
+                    'row': row_num,
+                    'error': gettext('日期格式错误：%(date)s') % {'date': row['order_date']}
+                })
+                continue
+            
+            # Parse consumer count
+            try:
+                consumer_count = int(row['consumer_count'])
+                if consumer_count <= 0:
                     errors.append({
                         'row': row_num,
-                        'error': gettext('记录已存在（ID: %(id)s）') % {'id': existing_record.id}
+                        'error': gettext('消费者人数必须大于0')
                     })
                     continue
+            except Exception:
+                errors.append({
+                    'row': row_num,
+                    'error': gettext('消费者人数格式错误：%(count)s') % {'count': row['consumer_count']}
+                })
+                continue
+            
+            # Get notes (optional)
+            notes = ''
+            if 'notes' in row and pd.notna(row['notes']):
+                notes = str(row['notes']).strip()
+            
+            candidates.append((row_num, restaurant, order_date, consumer_count, notes))
                 
-                # Create new record
-                ConsumerData.objects.create(
-                    restaurant=restaurant,
-                    order_date=order_date,
-                    consumer_count=consumer_count,
-                    notes=notes,
-                )
-                success_count += 1
-                    
-            except Exception as e:
+        except Exception as e:
+            errors.append({
+                'row': row_num,
+                'error': gettext('处理失败：%(error)s') % {'error': str(e)}
+            })
+    
+    to_create = []
+    if candidates:
+        restaurants = {c[1] for c in candidates}
+        date_range = (min(c[2] for c in candidates), max(c[2] for c in candidates))
+        
+        # Existing (restaurant, date) keys in the file's range, loaded once
+        existing_ids = {
+            (restaurant, order_date): pk
+            for restaurant, order_date, pk in ConsumerData.objects.filter(
+                restaurant__in=restaurants,
+                order_date__range=date_range,
+            ).values_list('restaurant', 'order_date', 'pk')
+        }
+        
+        # Daily emissions for the whole range in one grouped aggregate
+        daily_totals = {
+            (item['restaurant'], item['order_date']): item['total']
+            for item in MaterialConsumption.objects.filter(
+                restaurant__in=restaurants,
+                order_date__range=date_range,
+            ).values('restaurant', 'order_date').annotate(total=Sum('carbon_emission'))
+        }
+        
+        seen_rows = {}
+        for row_num, restaurant, order_date, consumer_count, notes in candidates:
+            key = (restaurant, order_date)
+            if key in existing_ids:
+                # Record already exists - treat as error
+                errors.append({
+                    'row': row_num,
+                    'error': gettext('记录已存在（ID: %(id)s）') % {'id': existing_ids[key]}
+                })
+                continue
+            if key in seen_rows:
                 errors.append({
                     'row': row_num,
-                    'error': gettext('处理失败：%(error)s') % {'error': str(e)}
+                    'error': gettext('文件中存在重复记录（与第 %(row)s 行相同）') % {'row': seen_rows[key]}
                 })
+                continue
+            seen_rows[key] = row_num
+            to_create.append(ConsumerData(
+                restaurant=restaurant,
+                order_date=order_date,
+                consumer_count=consumer_count,
+                notes=notes,
+                # bulk_create skips ConsumerData.save, so set the daily total here
+                daily_carbon_emission=daily_totals.get(key) or 0,
+            ))
+    
+    if to_create:
+        _write_consumer_rows(to_create)
+        success_count = len(to_create)
+    errors.sort(key=lambda item: item['row'])
+    error_count = len(errors)
+    if task is not None:
+        _save_task_errors(task, errors)
+        errors = []
     
     return {
         'success': True,
         'success_count': success_count,
+        'error_count': error_count,
+        # Without a task the errors are returned here; otherwise they are in task.errors
         'errors': errors,
         'total_rows': len(df)
     }
 
 
+@retry_on_lock
+def _write_consumer_rows(objs):
+    with transaction.atomic():
+        ConsumerData.objects.bulk_create(objs, batch_size=1000)
+        MonthlyRestaurantStats.refresh_months((obj.restaurant, obj.order_date) for obj in objs)
+
+
+def process_consumer_import_data_async(task_id, df, raw_df=None):
+    """Run process_consumer_import_data in background thread, updating ImportTask progress"""
+    _run_import_task(task_id, raw_df, lambda task: process_consumer_import_data(df, task=task))
+
+
 def consumer_download_template(request):
     """Download Excel template for consumer data import"""
     # Create a sample DataFrame with column headers
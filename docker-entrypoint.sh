@@ -4,10 +4,20 @@ set -e
 
 echo "Checking database..."
 
-# For SQLite, just ensure the directory exists
-mkdir -p /app
+if [ "${DB_ENGINE:-django.db.backends.sqlite3}" = "django.db.backends.postgresql" ]; then
+    # Wait for PostgreSQL to accept connections before migrating
+    for i in $(seq 1 30); do
+        if pg_isready -h "${DB_HOST:-localhost}" -p "${DB_PORT:-5432}" -U "${DB_USER:-postgres}" >/dev/null 2>&1; then
+            break
+        fi
+        echo "Waiting for PostgreSQL (${i}/30)..."
+        sleep 2
+    done
+else
+    # For SQLite, just ensure the database directory exists
+    mkdir -p "$(dirname "${DB_NAME:-/app/db.sqlite3}")"
+fi
 
-# Try to run migrations directly (SQLite doesn't need connection check)
 echo "Running database migrations..."
 python manage.py migrate --noinput || {
     echo "Migration failed, retrying in 5 seconds..."
@@ -34,6 +44,7 @@ exec gunicorn carbon_management.wsgi:application \
     --bind 0.0.0.0:8000 \
     --workers 4 \
     --threads 2 \
+    --worker-class "${GUNICORN_WORKER_CLASS:-gthread}" \
     --timeout 60 \
     --access-logfile - \
     --error-logfile - \